@@ -1,3 +1,5 @@
+import numpy as np
+
 FACES = [
   (0, 1, 0),
   (0, -1, 0),
@@ -7,37 +9,86 @@ FACES = [
   (0, 0, -1),
 ]
 
-class Block():
-  def __init__(self, pos = (0, 0, 0)):
+# Blocks are keyed by their integer position packed into one int, 21 bits
+# per axis, so sets and dicts of blocks hash plain ints. Coordinates must lie
+# within -OFFSET to OFFSET - 1.
+BITS = 21
+OFFSET = 1 << (BITS - 1)
+MASK = (1 << BITS) - 1
+
+# Added to a key to move it one block along x, y and z. Keys are linear in
+# the position, so the key of a neighbour is a single addition away.
+STEP_X = 1 << (2 * BITS)
+STEP_Y = 1 << BITS
+STEP_Z = 1
+
+# Added to a key to move it to the neighbour at each of FACES.
+FACE_STEPS = [dx * STEP_X + dy * STEP_Y + dz * STEP_Z for dx, dy, dz in FACES]
+
+
+def pack(position):
+  """ Returns the key of the integer `position`.
+
+  """
+  x, y, z = position
+  return ((x + OFFSET) << (2 * BITS)) | ((y + OFFSET) << BITS) | (z + OFFSET)
+
+
+def pack_many(positions):
+  """ Returns the keys of an (n, 3) array of integer positions as an array
+  of int64, see `pack()`.
+
+  """
+  p = np.asarray(positions, dtype=np.int64) + OFFSET
+  return (p[:, 0] << (2 * BITS)) | (p[:, 1] << BITS) | p[:, 2]
+
+
+def unpack(key):
+  """ Returns the integer position of `key`.
+
+  """
+  return ((key >> (2 * BITS)) - OFFSET,
+          ((key >> BITS) & MASK) - OFFSET,
+          (key & MASK) - OFFSET)
+
+
+def vertices(position):
+  x, y, z = position
+  return [
+    x-0.5, y+0.5, z-0.5, x-0.5, y+0.5, z+0.5,
+    x+0.5, y+0.5, z+0.5, x+0.5, y+0.5, z-0.5,  # top
+    x-0.5, y-0.5, z-0.5, x+0.5, y-0.5, z-0.5,
+    x+0.5, y-0.5, z+0.5, x-0.5, y-0.5, z+0.5,  # bottom
+    x-0.5, y-0.5, z-0.5, x-0.5, y-0.5, z+0.5,
+    x-0.5, y+0.5, z+0.5, x-0.5, y+0.5, z-0.5,  # left
+    x+0.5, y-0.5, z+0.5, x+0.5, y-0.5, z-0.5,
+    x+0.5, y+0.5, z-0.5, x+0.5, y+0.5, z+0.5,  # right
+    x-0.5, y-0.5, z+0.5, x+0.5, y-0.5, z+0.5,
+    x+0.5, y+0.5, z+0.5, x-0.5, y+0.5, z+0.5,  # front
+    x+0.5, y-0.5, z-0.5, x-0.5, y-0.5, z-0.5,
+    x-0.5, y+0.5, z-0.5, x+0.5, y+0.5, z-0.5,  # back
+  ]
+
+
+class Block(object):
+  """ Handle of a block that needs state of its own, i.e. a falling block
+  at a fractional position. Blocks at rest are only keys, see `pack()`.
+
+  """
+  __slots__ = ('_position', 'is_moving', 'velocity', 'block_id', 'vList')
+
+  def __init__(self, pos = (0, 0, 0), block_id = None):
     self._position = pos
     self.is_moving = False
     self.velocity = 0
-  
-  def __eq__(self, other):
-    return (other.getPosition()) == (self._position)
-  
-  def __hash__(self):
-    return hash(self._position)
-  
+    self.block_id = block_id
+    self.vList = None
+
   def getPosition(self):
     return self._position
-  
+
   def setPosition(self, pos):
     self._position = pos
-  
+
   def getVertices(self):
-    x, y, z = self._position
-    return [
-      x-0.5, y+0.5, z-0.5, x-0.5, y+0.5, z+0.5,
-      x+0.5, y+0.5, z+0.5, x+0.5, y+0.5, z-0.5,  # top
-      x-0.5, y-0.5, z-0.5, x+0.5, y-0.5, z-0.5, 
-      x+0.5, y-0.5, z+0.5, x-0.5, y-0.5, z+0.5,  # bottom
-      x-0.5, y-0.5, z-0.5, x-0.5, y-0.5, z+0.5, 
-      x-0.5, y+0.5, z+0.5, x-0.5, y+0.5, z-0.5,  # left
-      x+0.5, y-0.5, z+0.5, x+0.5, y-0.5, z-0.5, 
-      x+0.5, y+0.5, z-0.5, x+0.5, y+0.5, z+0.5,  # right
-      x-0.5, y-0.5, z+0.5, x+0.5, y-0.5, z+0.5, 
-      x+0.5, y+0.5, z+0.5, x-0.5, y+0.5, z+0.5,  # front
-      x+0.5, y-0.5, z-0.5, x-0.5, y-0.5, z-0.5, 
-      x-0.5, y+0.5, z-0.5, x+0.5, y+0.5, z-0.5,  # back
-    ]
\ No newline at end of file
+    return vertices(self._position)
@@ -0,0 +1,105 @@
+from __future__ import division
+
+import numpy as np
+
+# Id of empty space.
+AIR = 0
+
+# Number of texture coordinates of a block: 4 corners of 6 faces.
+UV_SIZE = 48
+
+
+class BlockTypes(object):
+    """ Registry of the kinds of blocks, giving each a small integer id.
+
+    The properties of every type are kept in arrays indexed by id, so they
+    can be looked up for single blocks in O(1) and for whole arrays of block
+    ids at once:
+
+    uvs : array of shape (n, 48)
+        Texture coordinates of the faces, see `Model.tex_coords()`.
+    solid : array of bools
+        Whether the player and falling blocks collide with the block.
+    breakable : array of bools
+        Whether the player can remove the block.
+    transparent : array of bools
+        Whether the block can be seen through. The faces of blocks next to a
+        transparent block of another type are visible, see
+        `ChunkStore.face_masks()`, and occlusion culling looks through it.
+        AIR is transparent.
+
+    Types are usually declared up front with `define()` but only get an id
+    when first used, see `id()`. Ids thus follow the order blocks were first
+    stored in, which keeps saved palettes valid. Id 0 is AIR.
+
+    """
+
+    def __init__(self):
+        # Name and texture of every type by id.
+        self.names = ['air']
+        self.textures = [None]
+
+        self.uvs = np.zeros((1, UV_SIZE), dtype=np.float32)
+        self.solid = np.zeros(1, dtype=bool)
+        self.breakable = np.zeros(1, dtype=bool)
+        self.transparent = np.ones(1, dtype=bool)
+
+        # Mapping from texture, as a tuple, to id.
+        self._ids = {}
+
+        # Mapping from texture, as a tuple, to the properties it was
+        # defined with, and from name to texture.
+        self._defined = {}
+        self._named = {}
+
+    def __len__(self):
+        return len(self.textures)
+
+    def define(self, name, texture, solid=True, breakable=True,
+               transparent=False):
+        """ Declare the type of blocks with `texture` and its properties.
+
+        """
+        key = tuple(texture)
+        self._defined[key] = (name, solid, breakable, transparent)
+        self._named[name] = texture
+        block_id = self._ids.get(key)
+        if block_id is not None:
+            self._set(block_id, name, solid, breakable, transparent)
+
+    def _set(self, block_id, name, solid, breakable, transparent):
+        self.names[block_id] = name
+        self.solid[block_id] = solid
+        self.breakable[block_id] = breakable
+        self.transparent[block_id] = transparent
+
+    def id(self, texture):
+        """ Returns the id of the type with `texture`, giving it the next id
+        if it has none yet. Types not declared with `define()` are solid,
+        breakable and opaque.
+
+        """
+        key = tuple(texture)
+        block_id = self._ids.get(key)
+        if block_id is None:
+            if len(self.textures) > np.iinfo(np.uint8).max:
+                raise ValueError('too many distinct block types')
+            block_id = len(self.textures)
+            self._ids[key] = block_id
+            self.names.append(None)
+            self.textures.append(texture)
+            self.uvs = np.vstack([self.uvs, np.array(
+                [texture], dtype=np.float32)])
+            self.solid = np.append(self.solid, True)
+            self.breakable = np.append(self.breakable, True)
+            self.transparent = np.append(self.transparent, False)
+            properties = self._defined.get(key)
+            if properties is not None:
+                self._set(block_id, *properties)
+        return block_id
+
+    def named(self, name):
+        """ Returns the id of the type defined as `name`.
+
+        """
+        return self.id(self._named[name])
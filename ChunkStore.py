@@ -0,0 +1,717 @@
+from __future__ import division
+
+import numpy as np
+
+from BlockTypes import AIR, BlockTypes
+
+# Neighbour offsets of a block. Bit `1 << i` of a face mask is set when the
+# face towards `FACES[i]` is visible.
+FACES = [
+    (0, 1, 0),
+    (0, -1, 0),
+    (-1, 0, 0),
+    (1, 0, 0),
+    (0, 0, 1),
+    (0, 0, -1),
+]
+
+# Index into FACES of the face pointing the opposite way.
+OPPOSITE = [1, 0, 3, 2, 5, 4]
+
+# Face mask with all six faces visible.
+ALL_FACES = (1 << len(FACES)) - 1
+
+
+def shows(block_id, neighbour, transparent=None):
+    """ Returns whether the face of a block with `block_id` towards a block
+    with id `neighbour` is visible: the neighbour is AIR or, given the
+    `transparent` flags of every block id, see `BlockTypes`, a transparent
+    block of another type. Works on scalars and arrays alike.
+
+    """
+    if transparent is None:
+        return (block_id != AIR) & (neighbour == AIR)
+    return (block_id != AIR) & transparent[neighbour] & (neighbour != block_id)
+
+
+def face_masks(ids, transparent=None):
+    """ Returns the face masks of the blocks of a 3D array of block ids,
+    without its outermost cells, which only serve as neighbours. See
+    `shows()` for `transparent`.
+
+    """
+    inner = ids[1:-1, 1:-1, 1:-1]
+    faces = np.zeros(inner.shape, dtype=np.uint8)
+    for face, (dx, dy, dz) in enumerate(FACES):
+        neighbours = ids[1 + dx:ids.shape[0] - 1 + dx,
+                         1 + dy:ids.shape[1] - 1 + dy,
+                         1 + dz:ids.shape[2] - 1 + dz]
+        faces |= np.where(shows(inner, neighbours, transparent),
+                          1 << face, 0).astype(np.uint8)
+    return faces
+
+
+def column_codes(columns):
+    """ Returns one int64 per (x, z) row of `columns`, equal for equal rows,
+    so sets of columns can be sorted and searched as 1D arrays.
+
+    """
+    columns = np.asarray(columns, dtype=np.int64)
+    return ((columns[:, 0] + (1 << 31)) << 32) | (columns[:, 1] + (1 << 31))
+
+
+class Chunk(object):
+    """ Dense storage for the blocks of one sector column.
+
+    Blocks are kept in a `uint8` array of shape (size, height, size) indexed
+    by local (x, y, z). The array only covers the vertical range that
+    actually holds blocks and grows in steps of `size` when a block is placed
+    above or below it.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+        # World y coordinate of `blocks[:, 0, :]`.
+        self.base = 0
+
+        # Block ids, AIR where there is no block.
+        self.blocks = np.zeros((size, 0, size), dtype=np.uint8)
+
+        # Face masks of the blocks, see `FACES`.
+        self.faces = np.zeros((size, 0, size), dtype=np.uint8)
+
+        # Number of non-AIR cells in `blocks`.
+        self.count = 0
+
+        # Number of blocks with at least one visible face in every layer of
+        # `blocks`, so buried layers can be skipped without looking at them.
+        self.exposed = np.zeros(0, dtype=np.int32)
+
+    @property
+    def top(self):
+        """ One past the highest world y coordinate covered by the chunk.
+
+        """
+        return self.base + self.blocks.shape[1]
+
+    def covers(self, y):
+        return self.base <= y < self.top
+
+    def fit(self, y):
+        """ Grow the chunk so that world height `y` is covered.
+
+        """
+        if self.covers(y):
+            return
+        size = self.size
+        lo = (y // size) * size
+        hi = lo + size
+        if self.blocks.shape[1]:
+            lo, hi = min(lo, self.base), max(hi, self.top)
+        start = self.base - lo
+        height = self.blocks.shape[1]
+        for name in ('blocks', 'faces'):
+            grown = np.zeros((size, hi - lo, size), dtype=np.uint8)
+            grown[:, start:start + height, :] = getattr(self, name)
+            setattr(self, name, grown)
+        exposed = np.zeros(hi - lo, dtype=np.int32)
+        exposed[start:start + height] = self.exposed
+        self.exposed = exposed
+        self.base = lo
+
+    def set_faces(self, index, mask):
+        """ Set the face mask of the block at `index`, keeping `exposed` up
+        to date.
+
+        """
+        old = self.faces[index]
+        self.faces[index] = mask
+        self.exposed[index[1]] += bool(mask) - bool(old)
+
+    def recount(self, lo=0, hi=None):
+        """ Recompute `exposed` for the layers `lo` to `hi` of the arrays.
+
+        """
+        self.exposed[lo:hi] = np.count_nonzero(self.faces[:, lo:hi, :],
+                                               axis=(0, 2))
+
+    def exposed_layers(self, lo=0, hi=None):
+        """ Returns the range of layers of the arrays between `lo` and `hi`
+        holding blocks with visible faces as a (lo, hi) pair, an empty range
+        if there are none.
+
+        """
+        lo = max(lo, 0)
+        if hi is not None:
+            hi = max(hi, lo)
+        layers = np.flatnonzero(self.exposed[lo:hi])
+        if not len(layers):
+            return lo, lo
+        return lo + int(layers[0]), lo + int(layers[-1]) + 1
+
+
+class ChunkStore(object):
+    """ Mapping from integer (x, y, z) positions to block textures backed by
+    one dense `Chunk` per column of sectors.
+
+    The store behaves like the dict it replaces: `in`, `[]`, `get()`,
+    assignment, `del` and `len()` all take block positions. Textures are
+    interned as `BlockTypes` ids so each block costs a single byte.
+
+    Alongside the ids every chunk keeps the face mask of each block, updated
+    incrementally as blocks are added and removed, so the visible faces of a
+    block never have to be recomputed from its neighbours.
+
+    Sectors are cubes of `size` blocks, indexed by (x, y, z) like blocks.
+    All sectors with the same x and z share the chunk of their column, keyed
+    by the sector at y = 0, see `column()`.
+
+    With a `source` attached, columns are loaded from it the first time they
+    are looked up; `len()` and iteration only cover the columns loaded so far.
+
+    """
+
+    def __init__(self, size, types=None):
+        # Edge length of a sector, see `sectorize()`.
+        self.size = size
+
+        # Mapping from column to its `Chunk`.
+        self.chunks = {}
+
+        # The block types the ids stand for, and their textures indexed by
+        # block id. Id 0 is AIR.
+        self.types = types if types is not None else BlockTypes()
+        self.palette = self.types.textures
+
+        # Where columns missing from `chunks` are loaded from on first use,
+        # e.g. a `Region.RegionStore`. None when all columns are in memory.
+        self.source = None
+
+        # Set of columns whose blocks or face masks changed since they were
+        # last saved to `source`.
+        self.modified = set()
+
+    def sector(self, position):
+        """ Returns the sector containing the block at `position`.
+
+        """
+        x, y, z = position
+        size = self.size
+        return (x // size, y // size, z // size)
+
+    def column(self, sector):
+        """ Returns the key in `chunks` of the column holding `sector`.
+
+        """
+        return (sector[0], 0, sector[2])
+
+    def sectors(self, column, lo, hi):
+        """ Returns the sectors of `column` overlapping the world heights `lo`
+        (inclusive) to `hi` (exclusive).
+
+        """
+        x, _, z = column
+        size = self.size
+        return set((x, y, z) for y in range(lo // size, (hi - 1) // size + 1))
+
+    def chunk(self, sector):
+        """ Returns the `Chunk` of the column of `sector`, loading it from
+        `source` the first time, or None if the column holds no blocks.
+
+        """
+        column = self.column(sector)
+        chunk = self.chunks.get(column)
+        if chunk is None and self.source is not None and \
+                column not in self.modified and column in self.source:
+            # A modified column missing from `chunks` was emptied, so the copy
+            # in `source` is stale.
+            chunk = self.source.load(column)
+            if chunk is not None:
+                self._stitch(column, chunk)
+                self.chunks[column] = chunk
+        return chunk
+
+    def _stitch(self, column, chunk):
+        """ Recompute the face masks on the sides of `chunk`, just loaded for
+        `column`, that touch loaded columns. Those may have been edited
+        since the source last saw them.
+
+        """
+        x, _, z = column
+        for face in range(2, len(FACES)):
+            dx, _, dz = FACES[face]
+            other = self.chunks.get((x + dx, 0, z + dz))
+            if other is None:
+                continue
+            axis = 0 if dx else 2
+            inside = [slice(None)] * 3
+            outside = [slice(None)] * 3
+            inside[axis] = -1 if dx + dz > 0 else 0
+            outside[axis] = 0 if dx + dz > 0 else -1
+            # Both sides as views of shape (height, size).
+            y = 1 if axis == 2 else 0
+            blocks = np.moveaxis(chunk.blocks[tuple(inside)], y, 0)
+            faces = np.moveaxis(chunk.faces[tuple(inside)], y, 0)
+            beyond = np.zeros_like(blocks)
+            lo, hi = max(chunk.base, other.base), min(chunk.top, other.top)
+            if lo < hi:
+                beyond[lo - chunk.base:hi - chunk.base] = np.moveaxis(
+                    other.blocks[tuple(outside)], y, 0)[
+                    lo - other.base:hi - other.base]
+            bit = 1 << face
+            faces[...] = np.where(
+                shows(blocks, beyond, self.types.transparent),
+                faces | bit, faces & (ALL_FACES ^ bit))
+        chunk.recount()
+
+    def block_id(self, texture):
+        """ Returns the palette id for `texture`, interning it if needed,
+        see `BlockTypes.id()`.
+
+        """
+        return self.types.id(texture)
+
+    def _cell(self, position):
+        """ Returns the chunk and the index into its arrays of `position`, or
+        (None, None) if no chunk covers it.
+
+        """
+        x, y, z = position
+        size = self.size
+        chunk = self.chunk((x // size, 0, z // size))
+        if chunk is None or not chunk.covers(y):
+            return None, None
+        return chunk, (x % size, y - chunk.base, z % size)
+
+    def get_id(self, position):
+        """ Returns the block id at `position`, AIR when there is no block.
+
+        """
+        chunk, index = self._cell(position)
+        if chunk is None:
+            return AIR
+        return chunk.blocks[index]
+
+    def get_ids(self, positions):
+        """ Returns the block ids at an array of positions of shape (n, 3),
+        looking up all positions within one chunk together.
+
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+        ids = np.zeros(len(positions), dtype=np.uint8)
+        if not len(positions):
+            return ids
+        size = self.size
+        codes = column_codes(positions[:, [0, 2]] // size)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        for index in np.split(order, bounds):
+            sx, _, sz = positions[index[0]] // size
+            chunk = self.chunk((int(sx), 0, int(sz)))
+            if chunk is None:
+                continue
+            x, y, z = positions[index].T
+            inside = (y >= chunk.base) & (y < chunk.top)
+            index = index[inside]
+            ids[index] = chunk.blocks[x[inside] % size, y[inside] - chunk.base,
+                                      z[inside] % size]
+        return ids
+
+    def flatten(self, columns):
+        """ Copy the block ids of the chunks of `columns`, an (n, 2) array of
+        (x, z) columns, into one flat array, so the ids of blocks spread over
+        all of them can be looked up with a single index.
+
+        Returns
+        -------
+        blocks : 1D array of uint8
+            The `Chunk.blocks` arrays of the columns one after the other.
+        offsets, bases, heights : 1D arrays of ints
+            Per column, where its blocks start in `blocks`, the world y
+            coordinate of its lowest layer and its number of layers. Missing
+            columns have no layers.
+
+        """
+        size = self.size
+        arrays = []
+        offsets = np.zeros(len(columns), dtype=np.int64)
+        bases = np.zeros(len(columns), dtype=np.int64)
+        heights = np.zeros(len(columns), dtype=np.int64)
+        offset = 0
+        for k, (x, z) in enumerate(np.asarray(columns).tolist()):
+            chunk = self.chunk((x, 0, z))
+            if chunk is None:
+                continue
+            arrays.append(chunk.blocks.ravel())
+            offsets[k] = offset
+            bases[k] = chunk.base
+            heights[k] = chunk.blocks.shape[1]
+            offset += size * heights[k] * size
+        if not arrays:
+            return np.zeros(0, dtype=np.uint8), offsets, bases, heights
+        return np.concatenate(arrays), offsets, bases, heights
+
+    def get_faces(self, position):
+        """ Returns the face mask of the block at `position`, 0 when there is
+        no block or none of its faces are visible.
+
+        """
+        chunk, index = self._cell(position)
+        if chunk is None:
+            return 0
+        return int(chunk.faces[index])
+
+    def set_id(self, position, block_id):
+        """ Store `block_id` at `position`. Storing AIR removes the block.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors in which a visible face appeared, disappeared or
+            changed its texture.
+
+        """
+        x, y, z = position
+        old = self.get_id(position)
+        if old == block_id:
+            return set()
+        sector = self.sector(position)
+        column = self.column(sector)
+        transparent = self.types.transparent
+        if old != AIR and block_id != AIR and not transparent[old] and \
+                not transparent[block_id]:
+            # Swapping one opaque block for another shows and hides no
+            # faces.
+            chunk, index = self._cell(position)
+            chunk.blocks[index] = block_id
+            self.modified.add(column)
+            return set([sector]) if chunk.faces[index] else set()
+        chunk = self.chunk(column)
+        if chunk is None:
+            chunk = self.chunks[column] = Chunk(self.size)
+        chunk.fit(y)
+        index = (x % self.size, y - chunk.base, z % self.size)
+        changed = set([sector])
+        mask = 0
+        for face, (dx, dy, dz) in enumerate(FACES):
+            neighbour = (x + dx, y + dy, z + dz)
+            other, other_index = self._cell(neighbour)
+            other_id = AIR if other is None else other.blocks[other_index]
+            if shows(block_id, other_id, transparent):
+                mask |= 1 << face
+            if other_id == AIR:
+                continue
+            # The neighbour's face towards this block.
+            bit = 1 << OPPOSITE[face]
+            faces = other.faces[other_index]
+            if shows(other_id, block_id, transparent):
+                new_faces = faces | bit
+            else:
+                new_faces = faces & (ALL_FACES ^ bit)
+            if new_faces != faces:
+                other.set_faces(other_index, new_faces)
+                changed.add(self.sector(neighbour))
+        if block_id == AIR:
+            chunk.blocks[index] = AIR
+            chunk.set_faces(index, 0)
+            chunk.count -= 1
+            if not chunk.count:
+                del self.chunks[column]
+        else:
+            chunk.blocks[index] = block_id
+            chunk.set_faces(index, mask)
+            chunk.count += old == AIR
+        self.modified.update(self.column(s) for s in changed)
+        return changed
+
+    def region(self, lo, hi):
+        """ Returns a dense array of the block ids inside the box spanning
+        from position `lo` (inclusive) to `hi` (exclusive).
+
+        """
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        size = self.size
+        ids = np.zeros((x1 - x0, y1 - y0, z1 - z0), dtype=np.uint8)
+        for sx in range(x0 // size, (x1 - 1) // size + 1):
+            for sz in range(z0 // size, (z1 - 1) // size + 1):
+                chunk = self.chunk((sx, 0, sz))
+                if chunk is None:
+                    continue
+                ax0, ax1 = max(x0, sx * size), min(x1, sx * size + size)
+                ay0, ay1 = max(y0, chunk.base), min(y1, chunk.top)
+                az0, az1 = max(z0, sz * size), min(z1, sz * size + size)
+                if ay0 >= ay1:
+                    continue
+                ids[ax0 - x0:ax1 - x0, ay0 - y0:ay1 - y0, az0 - z0:az1 - z0] = \
+                    chunk.blocks[ax0 - sx * size:ax1 - sx * size,
+                                 ay0 - chunk.base:ay1 - chunk.base,
+                                 az0 - sz * size:az1 - sz * size]
+        return ids
+
+    def write(self, lo, ids, where=None):
+        """ Store a whole box of block ids at once.
+
+        Parameters
+        ----------
+        lo : tuple of len 3
+            The position of `ids[0, 0, 0]`.
+        ids : 3D array of block ids
+            The ids to store. AIR removes blocks.
+        where : 3D array of bools, optional
+            Which cells of `ids` to store. Defaults to the non-AIR cells, so
+            the blocks already in the box are kept where `ids` is empty.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors whose blocks or face masks may have changed.
+
+        """
+        ids = np.asarray(ids, dtype=np.uint8)
+        if where is None:
+            where = ids != AIR
+        self._store(lo, ids, where)
+        x0, y0, z0 = lo
+        x1, y1, z1 = x0 + ids.shape[0], y0 + ids.shape[1], z0 + ids.shape[2]
+        return self.update_faces((x0 - 1, y0 - 1, z0 - 1),
+                                 (x1 + 1, y1 + 1, z1 + 1))
+
+    def _store(self, lo, ids, where):
+        """ Store the cells of `ids` selected by `where` like `write()`,
+        leaving the face masks as they are.
+
+        Returns
+        -------
+        columns : set of tuples of len 3
+            The columns whose blocks were written.
+
+        """
+        x0, y0, z0 = lo
+        x1, z1 = x0 + ids.shape[0], z0 + ids.shape[2]
+        size = self.size
+        columns = set()
+        for sx in range(x0 // size, (x1 - 1) // size + 1):
+            for sz in range(z0 // size, (z1 - 1) // size + 1):
+                ax0, ax1 = max(x0, sx * size), min(x1, sx * size + size)
+                az0, az1 = max(z0, sz * size), min(z1, sz * size + size)
+                part = (slice(ax0 - x0, ax1 - x0), slice(None),
+                        slice(az0 - z0, az1 - z0))
+                mask = where[part]
+                rows = np.nonzero(mask.any(axis=(0, 2)))[0]
+                if not len(rows):
+                    continue
+                column = (sx, 0, sz)
+                chunk = self.chunk(column)
+                if chunk is None:
+                    if not ids[part][mask].any():
+                        continue
+                    chunk = self.chunks[column] = Chunk(size)
+                chunk.fit(y0 + rows[0])
+                chunk.fit(y0 + rows[-1])
+                ay0, ay1 = y0 + rows[0], y0 + rows[-1] + 1
+                mask = mask[:, rows[0]:rows[-1] + 1, :]
+                target = chunk.blocks[ax0 - sx * size:ax1 - sx * size,
+                                      ay0 - chunk.base:ay1 - chunk.base,
+                                      az0 - sz * size:az1 - sz * size]
+                values = ids[part][:, rows[0]:rows[-1] + 1, :]
+                chunk.count += int(np.count_nonzero(values[mask])) - \
+                    int(np.count_nonzero(target[mask]))
+                target[mask] = values[mask]
+                columns.add(column)
+        return columns
+
+    def fill(self, lo, hi, block_id):
+        """ Set all blocks inside the box spanning from `lo` (inclusive) to
+        `hi` (exclusive) to `block_id`, AIR to clear the box.
+
+        Blocks inside the box cannot show any face to each other, so only the
+        face masks on either side of the box's surface are recomputed.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors whose blocks or face masks may have changed.
+
+        """
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        if x0 >= x1 or y0 >= y1 or z0 >= z1:
+            return set()
+        shape = (x1 - x0, y1 - y0, z1 - z0)
+        self._store(lo, np.full(shape, block_id, dtype=np.uint8),
+                    np.ones(shape, dtype=bool))
+        self._clear_faces((x0 + 1, y0 + 1, z0 + 1), (x1 - 1, y1 - 1, z1 - 1))
+        sectors = set()
+        for axis in range(3):
+            for side in (lo[axis], hi[axis]):
+                # A slab two blocks thick across this side of the surface.
+                # The slabs above and below reach every column of the box,
+                # so `update_faces()` drops all of those left empty.
+                slab_lo = [x0 - 1, y0 - 1, z0 - 1]
+                slab_hi = [x1 + 1, y1 + 1, z1 + 1]
+                slab_lo[axis], slab_hi[axis] = side - 1, side + 1
+                sectors.update(self.update_faces(slab_lo, slab_hi))
+        for sx in range((x0 - 1) // self.size, x1 // self.size + 1):
+            for sz in range((z0 - 1) // self.size, z1 // self.size + 1):
+                if (sx, 0, sz) in self.chunks or (sx, 0, sz) in self.modified:
+                    sectors.update(self.sectors((sx, 0, sz), y0 - 1, y1 + 1))
+        return sectors
+
+    def _clear_faces(self, lo, hi):
+        """ Clear the face masks of all blocks inside the box spanning from
+        `lo` (inclusive) to `hi` (exclusive).
+
+        """
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        if x0 >= x1 or y0 >= y1 or z0 >= z1:
+            return
+        size = self.size
+        for sx in range(x0 // size, (x1 - 1) // size + 1):
+            for sz in range(z0 // size, (z1 - 1) // size + 1):
+                chunk = self.chunks.get((sx, 0, sz))
+                if chunk is None:
+                    continue
+                ay0, ay1 = max(y0, chunk.base), min(y1, chunk.top)
+                if ay0 >= ay1:
+                    continue
+                chunk.faces[max(x0, sx * size) - sx * size:
+                            min(x1, sx * size + size) - sx * size,
+                            ay0 - chunk.base:ay1 - chunk.base,
+                            max(z0, sz * size) - sz * size:
+                            min(z1, sz * size + size) - sz * size] = 0
+                chunk.recount(ay0 - chunk.base, ay1 - chunk.base)
+
+    def replace(self, lo, hi, old, new):
+        """ Turn the blocks with id `old` inside the box spanning from `lo`
+        (inclusive) to `hi` (exclusive) into blocks with id `new`. Swapping
+        one opaque block for another shows and hides no faces, so the face
+        masks are only recomputed when `old` or `new` is AIR or transparent.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors whose blocks or face masks may have changed.
+
+        """
+        ids = self.region(lo, hi)
+        where = ids == old
+        if not where.any():
+            return set()
+        ids[where] = new
+        transparent = self.types.transparent
+        if transparent[old] or transparent[new]:
+            return self.write(lo, ids, where)
+        rows = np.nonzero(where.any(axis=(0, 2)))[0]
+        sectors = set()
+        for column in self._store(lo, ids, where):
+            self.modified.add(column)
+            sectors.update(self.sectors(column, lo[1] + rows[0],
+                                        lo[1] + rows[-1] + 1))
+        return sectors
+
+    def paste(self, lo, volume, palette):
+        """ Store a box of blocks given as indices into `palette`, a list of
+        textures starting with None for empty space. Empty cells keep the
+        blocks already in the world.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors whose blocks or face masks may have changed.
+
+        """
+        ids = np.array([AIR] + [self.block_id(t) for t in palette[1:]],
+                       dtype=np.uint8)
+        return self.write(lo, ids[volume])
+
+    def update_faces(self, lo, hi):
+        """ Recompute the face masks of all blocks inside the box spanning
+        from `lo` (inclusive) to `hi` (exclusive) and drop chunks left empty.
+
+        Returns
+        -------
+        sectors : set of tuples of len 3
+            The sectors overlapping the box.
+
+        """
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        faces = face_masks(self.region((x0 - 1, y0 - 1, z0 - 1),
+                                       (x1 + 1, y1 + 1, z1 + 1)),
+                           self.types.transparent)
+        size = self.size
+        sectors = set()
+        for sx in range(x0 // size, (x1 - 1) // size + 1):
+            for sz in range(z0 // size, (z1 - 1) // size + 1):
+                column = (sx, 0, sz)
+                chunk = self.chunk(column)
+                if chunk is None:
+                    continue
+                sectors.update(self.sectors(column, y0, y1))
+                self.modified.add(column)
+                if not chunk.count:
+                    del self.chunks[column]
+                    continue
+                ax0, ax1 = max(x0, sx * size), min(x1, sx * size + size)
+                ay0, ay1 = max(y0, chunk.base), min(y1, chunk.top)
+                az0, az1 = max(z0, sz * size), min(z1, sz * size + size)
+                if ay0 >= ay1:
+                    continue
+                chunk.faces[ax0 - sx * size:ax1 - sx * size,
+                            ay0 - chunk.base:ay1 - chunk.base,
+                            az0 - sz * size:az1 - sz * size] = \
+                    faces[ax0 - x0:ax1 - x0, ay0 - y0:ay1 - y0,
+                          az0 - z0:az1 - z0]
+                chunk.recount(ay0 - chunk.base, ay1 - chunk.base)
+        return sectors
+
+    def positions(self, sector):
+        """ Iterate over the positions of all blocks in `sector`.
+
+        """
+        chunk = self.chunk(sector)
+        if chunk is None:
+            return
+        size = self.size
+        lo = max(sector[1] * size - chunk.base, 0)
+        hi = max(sector[1] * size + size - chunk.base, 0)
+        ox, oz = sector[0] * size, sector[2] * size
+        for x, y, z in zip(*np.nonzero(chunk.blocks[:, lo:hi, :])):
+            yield (ox + int(x), chunk.base + lo + int(y), oz + int(z))
+
+    def __contains__(self, position):
+        return self.get_id(position) != AIR
+
+    def __getitem__(self, position):
+        block_id = self.get_id(position)
+        if block_id == AIR:
+            raise KeyError(position)
+        return self.palette[block_id]
+
+    def get(self, position, default=None):
+        block_id = self.get_id(position)
+        if block_id == AIR:
+            return default
+        return self.palette[block_id]
+
+    def __setitem__(self, position, texture):
+        self.set_id(position, self.block_id(texture))
+
+    def __delitem__(self, position):
+        if position not in self:
+            raise KeyError(position)
+        self.set_id(position, AIR)
+
+    def __len__(self):
+        return sum(chunk.count for chunk in self.chunks.values())
+
+    def __iter__(self):
+        for column, chunk in list(self.chunks.items()):
+            ox, oz = column[0] * self.size, column[2] * self.size
+            for x, y, z in zip(*np.nonzero(chunk.blocks)):
+                yield (ox + int(x), chunk.base + int(y), oz + int(z))
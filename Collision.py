@@ -0,0 +1,99 @@
+from __future__ import division
+
+import math
+
+import numpy as np
+
+# Boxes closer than this to a block count as touching, not overlapping, so
+# rounding errors never pin a box that rests against a wall.
+EPSILON = 1e-6
+
+
+def extents(height, pad=0.1):
+    """ Returns the extents of the box of an entity `height` blocks tall whose
+    position is the center of its top block.
+
+    Parameters
+    ----------
+    height : int
+        Height of the entity in blocks.
+    pad : float
+        How far the entity may sink into the blocks around it. If 0 the box
+        fills whole blocks, if .49 it is a thin pole.
+
+    Returns
+    -------
+    box : tuple of len 3
+        Half width of the box in x and z, extent below and extent above the
+        position.
+
+    """
+    return (0.5 - pad, height - 0.5 - pad, 0.5 - pad)
+
+
+def sweep(world, position, delta, box):
+    """ Move an axis-aligned box by `delta` through the blocks of `world`,
+    stopping it at the first block in its way.
+
+    Each axis is swept separately over its whole travel, so the box cannot
+    tunnel through thin walls no matter how far it moves in one call.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        The blocks to collide with.
+    position : tuple of len 3
+        The (x, y, z) position of the box.
+    delta : tuple of len 3
+        How far to move the box.
+    box : tuple of len 3
+        The extents of the box, see `extents()`.
+
+    Returns
+    -------
+    position : tuple of len 3
+        The position of the box after the move.
+    normals : list of tuples of len 3
+        The normals of the block faces the box came to rest against.
+
+    """
+    half, below, above = box
+    low = (half, below, half)
+    high = (half, above, half)
+    position = list(position)
+    normals = []
+    # Resolve gravity first so a landing box does not catch on the ground.
+    for axis in (1, 0, 2):
+        move = delta[axis]
+        if not move:
+            continue
+        lo = [position[i] - low[i] for i in range(3)]
+        hi = [position[i] + high[i] for i in range(3)]
+        # Range of blocks the box currently overlaps along every axis.
+        first = [int(math.floor(lo[i] + EPSILON - 0.5)) + 1 for i in range(3)]
+        last = [int(math.ceil(hi[i] - EPSILON + 0.5)) - 1 for i in range(3)]
+        # Layers of blocks the box enters along `axis` during the move.
+        if move > 0:
+            start = last[axis] + 1
+            stop = int(math.ceil(hi[axis] + move - EPSILON + 0.5))
+        else:
+            start = int(math.floor(lo[axis] + move + EPSILON - 0.5)) + 1
+            stop = first[axis]
+        if start < stop:
+            region_lo = list(first)
+            region_hi = [i + 1 for i in last]
+            region_lo[axis], region_hi[axis] = start, stop
+            ids = world.region(region_lo, region_hi)
+            others = tuple(i for i in range(3) if i != axis)
+            layers = np.flatnonzero(world.types.solid[ids].any(axis=others))
+            if len(layers):
+                normal = [0, 0, 0]
+                if move > 0:
+                    move = max(0.0, float(start + layers[0]) - 0.5 - hi[axis])
+                    normal[axis] = -1
+                else:
+                    move = min(0.0, float(start + layers[-1]) + 0.5 - lo[axis])
+                    normal[axis] = 1
+                normals.append(tuple(normal))
+        position[axis] += move
+    return tuple(position), normals
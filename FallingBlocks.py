@@ -0,0 +1,169 @@
+from __future__ import division
+
+import numpy as np
+
+from Mesher import CORNERS
+
+# Vertex offsets of a unit cube centered on the origin, four per face in the
+# order of `Mesher.CORNERS`.
+CUBE = np.where(CORNERS, 0.5, -0.5).reshape(-1, 3)
+
+# Marks falling blocks that found no ground during a step.
+NO_GROUND = np.iinfo(np.int64).min
+
+
+class FallingBlocks(object):
+    """ Blocks falling through the air, kept out of the world until they
+    land.
+
+    Every falling block is a row in a few compact arrays, so the whole set is
+    stepped and turned into geometry with a handful of NumPy operations.
+
+    """
+
+    def __init__(self):
+        # Center of every falling block. x and z stay on whole blocks.
+        self.positions = np.zeros((0, 3), dtype=np.float64)
+
+        # Vertical speed of every falling block.
+        self.velocities = np.zeros(0, dtype=np.float64)
+
+        # Block id of every falling block, see `ChunkStore.block_id()`.
+        self.ids = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, position, block_id, velocity=0.0):
+        """ Start a block with `block_id` falling from `position`.
+
+        """
+        self.positions = np.vstack([self.positions, [position]])
+        self.velocities = np.append(self.velocities, velocity)
+        self.ids = np.append(self.ids, np.uint8(block_id))
+
+    def step(self, world, dt, gravity, terminal_velocity):
+        """ Advance all falling blocks by `dt` seconds.
+
+        Parameters
+        ----------
+        world : ChunkStore
+            The blocks to land on.
+        dt : float
+            The change in time.
+        gravity : float
+            Downward acceleration.
+        terminal_velocity : float
+            Maximum falling speed.
+
+        Returns
+        -------
+        landed : list of ((x, y, z), block_id)
+            The blocks that landed during the step, lowest first. They are
+            removed from the falling blocks and should be added to the world
+            by the caller. Blocks landing in the same column stack on top of
+            each other rather than on the same cell.
+
+        """
+        if not len(self):
+            return []
+        self.velocities = np.maximum(self.velocities - dt * gravity,
+                                     -terminal_velocity)
+        move = self.velocities * dt
+        columns = np.rint(self.positions[:, [0, 2]]).astype(np.int64)
+        y = self.positions[:, 1]
+        # Range of blocks each falling block overlaps or would sink into when
+        # moved by `move`, checked highest first. It includes the block's
+        # current cell, which is solid if something was placed in its way.
+        top = np.floor(y).astype(np.int64)
+        bottom = np.floor(y + move).astype(np.int64)
+        ground = np.full(len(self), NO_GROUND)
+        for depth in range(int((top - bottom).max(initial=0)) + 1):
+            cell = top - depth
+            index = np.nonzero((cell >= bottom) & (ground == NO_GROUND))[0]
+            if not len(index):
+                break
+            probes = np.column_stack([columns[index, 0], cell[index],
+                                      columns[index, 1]])
+            solid = world.types.solid[world.get_ids(probes)]
+            ground[index[solid]] = cell[index[solid]]
+        self._stack(columns, bottom, ground)
+        landed = ground != NO_GROUND
+        self.positions[:, 1] = y + move
+        self._follow(columns, landed)
+        order = np.argsort(ground[landed], kind='stable')
+        result = [((int(x), int(g) + 1, int(z)), int(block_id))
+                  for (x, z), g, block_id in zip(columns[landed][order],
+                                                  ground[landed][order],
+                                                  self.ids[landed][order])]
+        keep = ~landed
+        self.positions = self.positions[keep]
+        self.velocities = self.velocities[keep]
+        self.ids = self.ids[keep]
+        return result
+
+    def _stack(self, columns, bottom, ground):
+        """ Land blocks on the blocks that landed below them in the same
+        step, which are not in the world yet.
+
+        Blocks in columns where any block landed are visited lowest first.
+        Every landing reserves its cell, so a block sinking into a reserved
+        cell lands on top of it instead, and two blocks never land on the
+        same cell.
+
+        """
+        landed = ground != NO_GROUND
+        if not landed.any():
+            return
+        shared = (columns[:, None, :] == columns[landed][None, :, :]).all(
+            axis=2).any(axis=1)
+        index = np.flatnonzero(shared)
+        index = index[np.argsort(self.positions[index, 1], kind='stable')]
+        # Mapping from column to the cells reserved in it.
+        reserved = {}
+        for i in index:
+            column = tuple(columns[i])
+            cells = reserved.setdefault(column, set())
+            g = ground[i]
+            for cell in cells:
+                if cell >= bottom[i] and cell > g:
+                    g = cell
+            if g == NO_GROUND:
+                continue
+            while g + 1 in cells:
+                g += 1
+            ground[i] = g
+            cells.add(g + 1)
+
+    def _follow(self, columns, landed):
+        """ Keep falling blocks from passing through each other: a block
+        that caught up with the one below it rests on it and takes over its
+        speed.
+
+        """
+        falling = np.flatnonzero(~landed)
+        if len(falling) < 2:
+            return
+        y = self.positions[:, 1]
+        falling = falling[np.lexsort((y[falling], columns[falling, 1],
+                                      columns[falling, 0]))]
+        for below, above in zip(falling[:-1], falling[1:]):
+            if (columns[below] == columns[above]).all() and \
+                    y[above] < y[below] + 1:
+                y[above] = y[below] + 1
+                self.velocities[above] = self.velocities[below]
+
+    def vertex_data(self):
+        """ Returns the `v3f` GL_QUADS vertices of all falling blocks as a flat
+        list.
+
+        """
+        return (self.positions[:, None, :] + CUBE).ravel().tolist()
+
+    def texture_data(self, uvs):
+        """ Returns the `t2f` texture coordinates of all falling blocks as a
+        flat list, given the texture coordinates `uvs` of every block type,
+        see `BlockTypes`.
+
+        """
+        return uvs[self.ids].ravel().tolist()
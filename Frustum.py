@@ -0,0 +1,103 @@
+from __future__ import division
+
+import math
+
+import numpy as np
+
+# Perspective of the 3D view, see `Window.set_3d()`. FAR reaches past the
+# farthest sectors drawn, see `Model.LOD_DISTANCES`.
+FOVY = 65.0
+NEAR = 0.1
+FAR = 224.0
+
+
+def perspective(fovy, aspect, near, far):
+    """ Returns the matrix set up by `gluPerspective()`.
+
+    """
+    f = 1.0 / math.tan(math.radians(fovy) / 2)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+        [0, 0, -1, 0],
+    ])
+
+
+def rotate(angle, x, y, z):
+    """ Returns the matrix multiplied in by `glRotatef()`.
+
+    """
+    x, y, z = np.array([x, y, z]) / math.sqrt(x * x + y * y + z * z)
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    t = 1 - c
+    return np.array([
+        [x * x * t + c, x * y * t - z * s, x * z * t + y * s, 0],
+        [y * x * t + z * s, y * y * t + c, y * z * t - x * s, 0],
+        [z * x * t - y * s, z * y * t + x * s, z * z * t + c, 0],
+        [0, 0, 0, 1],
+    ])
+
+
+def translate(x, y, z):
+    """ Returns the matrix multiplied in by `glTranslatef()`.
+
+    """
+    matrix = np.identity(4)
+    matrix[:3, 3] = x, y, z
+    return matrix
+
+
+def camera(rotation, position, aspect, fovy=FOVY, near=NEAR, far=FAR):
+    """ Returns the combined projection and modelview matrix of a player at
+    `position` looking along `rotation`, built the same way as
+    `Window.set_3d()`.
+
+    """
+    x, y = rotation
+    return perspective(fovy, aspect, near, far).dot(
+        rotate(x, 0, 1, 0)).dot(
+        rotate(-y, math.cos(math.radians(x)), 0, math.sin(math.radians(x)))).dot(
+        translate(*[-c for c in position]))
+
+
+def planes(matrix):
+    """ Returns the six clip planes of the view `matrix` as an array of shape
+    (6, 4). A point p is inside plane (a, b, c, d) when
+    a * p.x + b * p.y + c * p.z + d >= 0 (Gribb & Hartmann, "Fast Extraction
+    of Viewing Frustum Planes from the World-View-Projection Matrix").
+
+    """
+    rows = np.asarray(matrix)
+    result = np.array([
+        rows[3] + rows[0], rows[3] - rows[0],  # left, right
+        rows[3] + rows[1], rows[3] - rows[1],  # bottom, top
+        rows[3] + rows[2], rows[3] - rows[2],  # near, far
+    ])
+    return result / np.sqrt((result[:, :3] ** 2).sum(axis=1))[:, None]
+
+
+def visible(planes, lo, hi):
+    """ Test axis-aligned boxes against a frustum.
+
+    Parameters
+    ----------
+    planes : array of shape (6, 4)
+        The frustum, see `planes()`.
+    lo, hi : arrays of shape (n, 3)
+        The lower and upper corners of the boxes.
+
+    Returns
+    -------
+    visible : array of bools of shape (n,)
+        False for boxes entirely outside the frustum. Boxes near a corner of
+        the frustum may be reported visible even if they are not.
+
+    """
+    lo = np.asarray(lo, dtype=np.float64).reshape(-1, 3)
+    hi = np.asarray(hi, dtype=np.float64).reshape(-1, 3)
+    normals, offsets = planes[:, :3], planes[:, 3]
+    # The corner of each box furthest along the normal of each plane.
+    corners = np.where(normals[None, :, :] > 0, hi[:, None, :], lo[:, None, :])
+    distances = (corners * normals[None, :, :]).sum(axis=2) + offsets
+    return (distances >= 0).all(axis=1)
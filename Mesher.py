@@ -0,0 +1,273 @@
+from __future__ import division
+
+import numpy as np
+
+from ChunkStore import AIR, FACES, shows
+
+# Corners of each face of a unit cube as signs along x, y and z, in the
+# order of `FACES` (top, bottom, left, right, front, back). Every face is
+# wound counter-clockwise seen from outside the cube, so back-face culling
+# keeps working.
+CORNERS = np.array([
+    [(-1, 1, -1), (-1, 1, 1), (1, 1, 1), (1, 1, -1)],  # top
+    [(-1, -1, -1), (1, -1, -1), (1, -1, 1), (-1, -1, 1)],  # bottom
+    [(-1, -1, -1), (-1, -1, 1), (-1, 1, 1), (-1, 1, -1)],  # left
+    [(1, -1, 1), (1, -1, -1), (1, 1, -1), (1, 1, 1)],  # right
+    [(-1, -1, 1), (1, -1, 1), (1, 1, 1), (-1, 1, 1)],  # front
+    [(1, -1, -1), (-1, -1, -1), (-1, 1, -1), (1, 1, -1)],  # back
+]) > 0
+
+# Texture coordinates of the four corners of every face, see `tex_coord()`.
+TEX_CORNERS = np.array([(0, 0), (1, 0), (1, 1), (0, 1)])
+
+# Axis along which the s and t texture coordinates run for every face.
+TEX_AXES = [
+    (int(np.flatnonzero(c[1] != c[0])[0]), int(np.flatnonzero(c[2] != c[1])[0]))
+    for c in CORNERS
+]
+
+
+def greedy_rectangles(grid):
+    """ Cover the non-zero cells of a 2D `grid` with rectangles of equal
+    value.
+
+    Rows are scanned in order; each rectangle is grown as wide as possible
+    and then as tall as the rows below allow.
+
+    Returns
+    -------
+    rectangles : list of tuples (i, j, h, w, value)
+        Row, column, height and width of every rectangle and the value of the
+        cells it covers.
+
+    """
+    rows = grid.tolist()
+    rectangles = []
+    for i, row in enumerate(rows):
+        width = len(row)
+        j = 0
+        while j < width:
+            value = row[j]
+            if not value:
+                j += 1
+                continue
+            w = 1
+            while j + w < width and row[j + w] == value:
+                w += 1
+            span = [value] * w
+            h = 1
+            while i + h < len(rows) and rows[i + h][j:j + w] == span:
+                h += 1
+            for covered in rows[i:i + h]:
+                covered[j:j + w] = [0] * w
+            rectangles.append((i, j, h, w, value))
+            j += w
+    return rectangles
+
+
+def downsample(blocks, faces, factor, transparent=None):
+    """ Merge the blocks of a sector into cells of `factor` blocks along each
+    axis, for drawing it at a coarser level of detail.
+
+    A cell takes the id of its highest block, so hills keep the texture of
+    their tops. Of several blocks at the same height, the first in x then z
+    order wins. A face of a cell is visible when the next cell can be seen
+    through, see `ChunkStore.shows()`, or, at the border of the sector, when
+    a block of the cell shows that face.
+
+    Parameters
+    ----------
+    blocks, faces : 3D arrays of uint8
+        The block ids and face masks of a whole sector. Every side must be a
+        multiple of `factor`.
+    factor : int
+        Edge length of the cells in blocks.
+    transparent : array of bools, optional
+        Whether every block id can be seen through, see `BlockTypes`. By
+        default only AIR can.
+
+    Returns
+    -------
+    blocks, faces : 3D arrays of uint8
+        The block ids and face masks of the cells.
+
+    """
+    nx, ny, nz = [n // factor for n in blocks.shape]
+    shape = (nx, factor, ny, factor, nz, factor)
+    fine = blocks.reshape(shape)
+    # Id and height within the cell of the highest block of every column of
+    # every cell, -1 for an empty column.
+    top = np.zeros((nx, factor, ny, nz, factor), dtype=np.uint8)
+    height = np.full(top.shape, -1, dtype=np.int8)
+    for y in range(factor):
+        layer = fine[:, :, :, y, :, :]
+        top = np.where(layer != AIR, layer, top)
+        height = np.where(layer != AIR, y, height)
+    # Columns of a cell along the last axis.
+    top = top.transpose(0, 2, 3, 1, 4).reshape(nx, ny, nz, -1)
+    height = height.transpose(0, 2, 3, 1, 4).reshape(nx, ny, nz, -1)
+    highest = height.argmax(axis=-1)[..., None]
+    ids = np.take_along_axis(top, highest, axis=-1)[..., 0]
+    solid = ids != AIR
+    masks = np.zeros(ids.shape, dtype=np.uint8)
+    fine_faces = faces.reshape(shape)
+    for face, offset in enumerate(FACES):
+        shown = ((fine_faces & (1 << face)) != 0).any(axis=(1, 3, 5))
+        axis = [i for i in range(3) if offset[i]][0]
+        step = offset[axis]
+        # Whether the next cell along the face can be seen through, taken
+        # from the blocks of the cell itself at the border of the sector.
+        empty = shown.copy()
+        inner = [slice(None)] * 3
+        inner[axis] = slice(None, -1) if step > 0 else slice(1, None)
+        neighbours = [slice(None)] * 3
+        neighbours[axis] = slice(1, None) if step > 0 else slice(None, -1)
+        empty[tuple(inner)] = shows(ids[tuple(inner)], ids[tuple(neighbours)],
+                                    transparent)
+        masks |= np.where(solid & empty, 1 << face, 0).astype(np.uint8)
+    return ids, masks
+
+
+def build_mesh(offset, blocks, faces, table, tiles, level=0,
+               transparent=None):
+    """ Build the geometry of one sector from copies of its chunk arrays, see
+    `SectorMesher.snapshot()`. Needs no access to the world, so it can run in
+    a worker thread or process. Worker processes import this module, which
+    must therefore not import pyglet or OpenGL.
+
+    Parameters
+    ----------
+    offset : tuple of len 3
+        The position of `blocks[0, 0, 0]` relative to the lowest block of the
+        sector.
+    blocks, faces : 3D arrays of uint8
+        The block ids and face masks of the sector.
+    table : 2D array of ints
+        Per face lookup table from block id to tile key, 0 for no tile.
+    tiles : int
+        Number of tiles along each side of the texture atlas.
+    level : int
+        Level of detail. Level n merges cells of 2 ** n blocks along each
+        axis, see `downsample()`; `blocks` must then cover the whole sector.
+    transparent : array of bools, optional
+        Whether every block id can be seen through, for the faces of merged
+        cells, see `downsample()`. At level 0 the visible faces are those
+        set in `faces`, which the world keeps up to date.
+
+    Returns
+    -------
+    mesh : dict
+        Mapping from atlas tile (x, y) to a (vertex_data, texture_data)
+        pair of flat lists of ints suitable for `v3s` and `t2s` GL_QUADS.
+        Vertices are relative to the lower corner of the sector, so every
+        coordinate lies between 0 and the sector size and they must be drawn
+        translated to the sector, see `Renderer.draw()`.
+
+    """
+    if not blocks.size:
+        return {}
+    offset = np.array(offset)
+    factor = 2 ** level
+    if level:
+        blocks, faces = downsample(blocks, faces, factor, transparent)
+    quads = {}
+    for face, (dx, dy, dz) in enumerate(FACES):
+        visible = (faces & (1 << face)) != 0
+        keys = np.where(visible, table[face][blocks], 0)
+        axis = (0 if dx else 1 if dy else 2)
+        u, v = [a for a in range(3) if a != axis]
+        for layer in np.nonzero(keys.any(axis=(u, v)))[0]:
+            grid = np.take(keys, layer, axis=axis)
+            for i, j, h, w, key in greedy_rectangles(grid):
+                lower = [0, 0, 0]
+                upper = [0, 0, 0]
+                lower[axis], upper[axis] = layer, layer + 1
+                lower[u], upper[u] = i, i + h
+                lower[v], upper[v] = j, j + w
+                quads.setdefault(key, []).append((face, lower, upper))
+    result = {}
+    for key, entries in quads.items():
+        face_ids = np.array([e[0] for e in entries])
+        lower = np.array([e[1] for e in entries]) * factor + offset
+        upper = np.array([e[2] for e in entries]) * factor + offset
+        corners = CORNERS[face_ids]
+        vertices = np.where(corners, upper[:, None, :], lower[:, None, :])
+        extent = upper - lower
+        axes = np.array([TEX_AXES[f] for f in face_ids])
+        scale = np.take_along_axis(extent, axes, axis=1)
+        tex = TEX_CORNERS[None, :, :] * scale[:, None, :]
+        tile = divmod(key - 1, tiles)[::-1]
+        result[tile] = (vertices.ravel().tolist(), tex.ravel().tolist())
+    return result
+
+
+class SectorMesher(object):
+    """ Builds merged quad geometry for a whole sector of a `ChunkStore`.
+
+    Only faces set in the chunk's face masks are emitted, and coplanar faces
+    sharing a texture tile are merged into larger quads. Texture
+    coordinates of a merged quad span one unit per block, so every tile must
+    be drawn from its own texture with GL_REPEAT wrapping.
+
+    """
+
+    def __init__(self, world, tiles=4):
+        # The `ChunkStore` to build meshes from.
+        self.world = world
+
+        # Number of tiles along each side of the texture atlas.
+        self.tiles = tiles
+
+        # Per face lookup table from block id to tile key, 0 for no tile.
+        self._lookup = None
+
+    def _tile_lookup(self):
+        types = self.world.types
+        if self._lookup is None or self._lookup[1] != len(types):
+            table = np.zeros((len(FACES), 256), dtype=np.int32)
+            for face in range(len(FACES)):
+                x = np.round(types.uvs[:, face * 8] * self.tiles)
+                y = np.round(types.uvs[:, face * 8 + 1] * self.tiles)
+                table[face, :len(types)] = 1 + x + y * self.tiles
+            table[:, AIR] = 0
+            self._lookup = (table, len(types))
+        return self._lookup[0]
+
+    def snapshot(self, sector, level=0):
+        """ Returns copies of everything `build_mesh()` needs to mesh
+        `sector` at `level` of detail, so the mesh can be built while the
+        world keeps changing. Only the layers holding exposed blocks are
+        copied, so the cost of meshing follows the number of exposed blocks
+        rather than the size of the sector.
+
+        """
+        size = self.world.size
+        chunk = self.world.chunk(sector)
+        lo = hi = base = 0
+        if chunk is not None:
+            bottom = sector[1] * size - chunk.base
+            lo, hi = chunk.exposed_layers(bottom, bottom + size)
+            base = chunk.base + lo
+        if lo == hi:
+            blocks = faces = np.zeros((size, 0, size), dtype=np.uint8)
+        else:
+            blocks = chunk.blocks[:, lo:hi, :].copy()
+            faces = chunk.faces[:, lo:hi, :].copy()
+        offset = (0, base - sector[1] * size, 0)
+        if level and lo != hi:
+            # Coarser levels merge cells aligned to the sector, so the
+            # arrays must cover all of it.
+            y = offset[1]
+            padded = np.zeros((2, size, size, size), dtype=np.uint8)
+            padded[0, :, y:y + hi - lo, :] = blocks
+            padded[1, :, y:y + hi - lo, :] = faces
+            blocks, faces, offset = padded[0], padded[1], (0, 0, 0)
+        return (offset, blocks, faces, self._tile_lookup(), self.tiles, level,
+                self.world.types.transparent.copy())
+
+    def mesh(self, sector, level=0):
+        """ Build the geometry of `sector` at `level` of detail, see
+        `build_mesh()`.
+
+        """
+        return build_mesh(*self.snapshot(sector, level))
@@ -0,0 +1,414 @@
+from __future__ import division
+
+import random
+
+import numpy as np
+
+import Terrain
+from BlockTypes import BlockTypes
+from ChunkStore import AIR, ChunkStore
+from Occlusion import SectorGraph
+from Raycast import raycast, raycast_many
+from Region import RegionStore
+
+# Size of sectors used to ease block loading.
+SECTOR_SIZE = 16
+
+# 1/2 width and height of the generated world and the number of hills on it.
+WORLD_SIZE = 80
+HILLS = 120
+
+# Radius in sectors up to which sectors are drawn at each level of detail,
+# see `nearby_levels()`.
+LOD_DISTANCES = (4, 8, 12)
+
+# Most columns of a streamed world kept in memory, see `Model.evict()`. Must
+# exceed the columns within `LOD_DISTANCES[-1]` sectors of the player.
+MAX_COLUMNS = 1024
+
+
+def tex_coord(x, y, n=4):
+    """ Return the bounding vertices of the texture square.
+
+    """
+    m = 1.0 / n
+    dx = x * m
+    dy = y * m
+    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
+
+
+def tex_coords(top, bottom, side):
+    """ Return a list of the texture squares for the top, bottom and side.
+
+    """
+    top = tex_coord(*top)
+    bottom = tex_coord(*bottom)
+    side = tex_coord(*side)
+    result = []
+    result.extend(top)
+    result.extend(bottom)
+    result.extend(side * 4)
+    return result
+
+
+GRASS = tex_coords((1, 0), (0, 1), (0, 0))
+SAND = tex_coords((1, 1), (1, 1), (1, 1))
+BRICK = tex_coords((2, 0), (2, 0), (2, 0))
+STONE = tex_coords((2, 1), (2, 1), (2, 1))
+
+
+def block_types():
+    """ Returns a registry of the block types of the game.
+
+    """
+    types = BlockTypes()
+    types.define('grass', GRASS)
+    types.define('sand', SAND)
+    types.define('brick', BRICK)
+    types.define('stone', STONE, breakable=False)
+    return types
+
+
+def normalize(position):
+    """ Accepts `position` of arbitrary precision and returns the block
+    containing that position.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+
+    Returns
+    -------
+    block_position : tuple of ints of len 3
+
+    """
+    x, y, z = position
+    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
+    return (x, y, z)
+
+
+def sectorize(position):
+    """ Returns a tuple representing the sector for the given `position`.
+
+    Parameters
+    ----------
+    position : tuple of len 3
+
+    Returns
+    -------
+    sector : tuple of len 3
+
+    """
+    x, y, z = normalize(position)
+    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
+    return (x, y, z)
+
+
+def nearby_sectors(sector, pad=4, vertical=2):
+    """ Returns the set of sectors shown around a player in `sector`: those
+    within a sphere of `pad` sectors, cut off `vertical` sectors above and
+    below.
+
+    """
+    x, y, z = sector
+    sectors = set()
+    for dx in range(-pad, pad + 1):
+        for dy in range(-vertical, vertical + 1):
+            for dz in range(-pad, pad + 1):
+                if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
+                    continue
+                sectors.add((x + dx, y + dy, z + dz))
+    return sectors
+
+
+def nearby_levels(sector, distances=LOD_DISTANCES, vertical=2):
+    """ Returns a mapping from the sectors shown around a player in `sector`
+    to the level of detail to draw them at: level i for the sectors within
+    `distances[i]` sectors that are not within `distances[i - 1]`.
+
+    """
+    x, y, z = sector
+    levels = {}
+    for dx, dy, dz in nearby_sectors((0, 0, 0), distances[-1], vertical):
+        distance = dx ** 2 + dy ** 2 + dz ** 2
+        level = 0
+        while distance > (distances[level] + 1) ** 2:
+            level += 1
+        levels[(x + dx, y + dy, z + dz)] = level
+    return levels
+
+
+class Model(object):
+    """ The blocks of the world. The model has no OpenGL state, so it can be
+    used without a display; see `Renderer` in main.py for drawing it.
+
+    """
+
+    def __init__(self, world_size=WORLD_SIZE, hills=HILLS, path=None,
+                 seed=None, max_columns=MAX_COLUMNS):
+
+        # A mapping from position to the texture of the block at that position.
+        # This defines all the blocks that are currently in the world. Blocks
+        # are stored per sector in dense arrays, see `ChunkStore`.
+        self.world = ChunkStore(SECTOR_SIZE, block_types())
+
+        # Set of sectors edited since their mesh was last built. Drained by
+        # the renderer.
+        self.dirty = set()
+
+        # Which sectors can be seen from which, for culling those hidden
+        # behind terrain. Updated on every edit.
+        self.graph = SectorGraph(self.world)
+
+        # The region files the world is saved to, None if it is not saved.
+        # Sectors of a saved world are loaded as they are first needed.
+        self.storage = None
+
+        # Generates the columns of an endless world as they are first
+        # needed, None for a world of `world_size`.
+        self.generator = None
+
+        # Most columns kept in memory while the world streams, see `evict()`.
+        self.max_columns = max_columns
+
+        # What the terrain was generated from, None as `world_size` for an
+        # endless world. A seed of None is drawn from `random`, so seeding
+        # that still fixes the world.
+        self.world_size = world_size
+        self.hills = hills
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+
+        if path is None:
+            if world_size is None:
+                self._stream(self.seed)
+            else:
+                self._initialize(world_size, hills)
+            return
+        self.storage = RegionStore(path, SECTOR_SIZE)
+        settings = self.storage.settings
+        generate = not self.storage.palette
+        if generate:
+            settings['endless'] = world_size is None
+            settings['seed'] = self.seed
+        self.seed = settings.get('seed', self.seed)
+        self.storage.attach(self.world)
+        if settings.get('endless'):
+            self.world_size = None
+            self._stream(self.seed)
+        elif generate:
+            self._initialize(world_size, hills)
+        if generate:
+            self.save()
+
+    def _initialize(self, n, hills):
+        """ Initialize the world by placing all the blocks. The terrain is
+        generated as a whole by `Terrain.generate()` and stored in one pass.
+
+        Parameters
+        ----------
+        n : int
+            1/2 width and height of world.
+        hills : int
+            Number of hills to generate.
+
+        """
+        lo, volume, palette = Terrain.generate(
+            n, GRASS, STONE, [GRASS, SAND, BRICK], hills=hills, wall_height=3,
+            rng=random.Random(self.seed))
+        self.world.paste(lo, volume, palette)
+
+    def _stream(self, seed):
+        """ Make the world endless: columns are generated from `seed` by a
+        `Terrain.Generator` the first time they are needed, unless they were
+        saved before.
+
+        """
+        grass, stone, sand, brick = [self.world.types.named(name) for name
+                                     in ('grass', 'stone', 'sand', 'brick')]
+        self.generator = Terrain.Generator(
+            SECTOR_SIZE, grass, stone, [grass, sand, brick], seed=seed,
+            types=self.world.types)
+        if self.storage is None:
+            self.world.source = self.generator
+        else:
+            self.storage.fallback = self.generator
+
+    def save(self):
+        """ Write the sectors edited since the last save back to the region
+        files. Does nothing if the world is not saved.
+
+        """
+        if self.storage is not None:
+            self.storage.save(self.world)
+
+    def evict(self, sector):
+        """ Drop the columns farthest from `sector` once more than
+        `max_columns` are in memory. They are loaded again from the world's
+        source when next needed, so this only applies to streamed worlds.
+        Edited columns are saved first, or kept if the world is not saved.
+
+        Returns
+        -------
+        columns : list of tuples
+            The columns dropped.
+
+        """
+        world = self.world
+        if world.source is None or len(world.chunks) <= self.max_columns:
+            return []
+        x, _, z = sector
+        columns = sorted(world.chunks, key=lambda c: (c[0] - x) ** 2 +
+                         (c[2] - z) ** 2)[self.max_columns:]
+        if self.storage is None:
+            columns = [c for c in columns if c not in world.modified]
+        else:
+            self.storage.save(world, world.modified.intersection(columns))
+        for column in columns:
+            del world.chunks[column]
+        self.graph.forget(columns)
+        return columns
+
+    def hit_test(self, position, vector, max_distance=8):
+        """ Line of sight search from current position. If a block is
+        intersected it is returned, along with the block previously in the line
+        of sight and the face of the block that was hit. If no block is found,
+        return None, the last block in the line of sight and None.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position to check visibility from.
+        vector : tuple of len 3
+            The line of sight vector.
+        max_distance : int
+            How many blocks away to search for a hit.
+
+        """
+        return raycast(self.world.__contains__, position, vector, max_distance)
+
+    def hit_test_many(self, positions, vectors, max_distance=8):
+        """ Line of sight search for many rays at once, see
+        `Raycast.raycast_many()` for the returned arrays.
+
+        Parameters
+        ----------
+        positions : array of shape (n, 3)
+            The positions to check visibility from.
+        vectors : array of shape (n, 3)
+            The line of sight vectors.
+        max_distance : int
+            How many blocks away to search for a hit.
+
+        """
+        return raycast_many(self.world, positions, vectors, max_distance)
+
+    def exposed(self, position):
+        """ Returns False is given `position` is surrounded on all 6 sides by
+        blocks, True otherwise.
+
+        """
+        return self.world.get_faces(position) != 0
+
+    def add_block(self, position, block_id):
+        """ Add a block of the given type and `position` to the world. Every
+        sector whose faces changed is marked dirty, so shown sectors never
+        keep a stale mesh.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to add.
+        block_id : int
+            The type of the block, see `BlockTypes`. Look types up once with
+            `world.types.named()`. AIR removes the block.
+
+        """
+        changed = self.world.set_id(position, block_id)
+        self.graph.invalidate(self.world.sector(position))
+        self.check_neighbors(changed)
+
+    def remove_block(self, position):
+        """ Remove the block at the given `position`.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to remove.
+
+        """
+        if position not in self.world:
+            raise KeyError(position)
+        self.add_block(position, AIR)
+
+    def check_neighbors(self, sectors):
+        """ Mark `sectors`, the sectors in which an edit made single faces
+        appear or disappear, as dirty. The world updates the face masks of a
+        block and its neighbours on every edit, so a sector bordering the edit
+        is only rebuilt when one of its faces actually changed. Dirty sectors
+        that are shown are rebuilt by the renderer's next `process_queue()`.
+        Usually used after a block is added or removed.
+
+        """
+        self.dirty.update(sectors)
+
+    def fill_box(self, lo, hi, block_id):
+        """ Fill the box spanning from `lo` (inclusive) to `hi` (exclusive)
+        with blocks of type `block_id` in one pass. Every sector touched is
+        rebuilt once, however many blocks changed in it.
+
+        """
+        self._edited(lo, hi, self.world.fill(lo, hi, block_id))
+
+    def clear_box(self, lo, hi):
+        """ Remove all blocks inside the box spanning from `lo` (inclusive)
+        to `hi` (exclusive), see `fill_box()`.
+
+        """
+        self._edited(lo, hi, self.world.fill(lo, hi, AIR))
+
+    def replace(self, lo, hi, old, new):
+        """ Turn the blocks of type `old` inside the box spanning from `lo`
+        (inclusive) to `hi` (exclusive) into blocks of type `new`, see
+        `fill_box()`. Either may be AIR for empty space.
+
+        """
+        self._edited(lo, hi, self.world.replace(lo, hi, old, new))
+
+    def paste_structure(self, position, structure):
+        """ Place a structure with its origin at `position`, see
+        `fill_box()`.
+
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the origin of the structure.
+        structure : dict
+            Mapping from (x, y, z) offsets from the origin to the type id of
+            the block there, AIR to clear it. Blocks not in the mapping are
+            kept.
+
+        """
+        if not structure:
+            return
+        offsets = np.array(list(structure.keys()))
+        low = offsets.min(axis=0)
+        ids = np.zeros(offsets.max(axis=0) - low + 1, dtype=np.uint8)
+        where = np.zeros(ids.shape, dtype=bool)
+        cells = tuple((offsets - low).T)
+        ids[cells] = list(structure.values())
+        where[cells] = True
+        lo = tuple(int(c) for c in np.add(position, low))
+        hi = tuple(int(c) for c in np.add(lo, ids.shape))
+        self._edited(lo, hi, self.world.write(lo, ids, where))
+
+    def _edited(self, lo, hi, sectors):
+        """ Mark `sectors`, changed by an edit of the box spanning from `lo`
+        to `hi`, as dirty and drop the face links of the sectors inside it.
+
+        """
+        self.check_neighbors(sectors)
+        world = self.world
+        for sector in sectors:
+            if all(c * world.size < h and (c + 1) * world.size > l
+                   for c, l, h in zip(sector, lo, hi)):
+                self.graph.invalidate(sector)
@@ -0,0 +1,148 @@
+from __future__ import division
+
+from collections import deque
+
+import numpy as np
+
+from ChunkStore import AIR, ALL_FACES, FACES, OPPOSITE
+
+
+def face_links(blocks, transparent=None):
+    """ Find which faces of a sector can see each other through its air and
+    transparent blocks.
+
+    Parameters
+    ----------
+    blocks : 3D array of uint8
+        The block ids of the whole sector.
+    transparent : array of bools, optional
+        Whether every block id can be seen through, see `BlockTypes`. By
+        default only AIR can.
+
+    Returns
+    -------
+    links : tuple of 6 ints
+        For every face of the sector, in the order of `FACES`, the mask of
+        faces joined to it by a path of blocks that can be seen through.
+
+    """
+    if transparent is None:
+        air = blocks == AIR
+    else:
+        air = transparent[blocks]
+    if air.all():
+        return (ALL_FACES,) * len(FACES)
+    if not air.any():
+        return (0,) * len(FACES)
+    # Label every air block with the lowest index of an air block it is
+    # connected to: spread the labels to the neighbours and follow them
+    # through the labels of the blocks they point at until nothing changes.
+    empty = air.size
+    labels = np.where(air, np.arange(air.size).reshape(air.shape), empty)
+    while True:
+        spread = labels.copy()
+        for axis in range(3):
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+            lower, upper = tuple(lower), tuple(upper)
+            np.minimum(spread[upper], labels[lower], out=spread[upper])
+            np.minimum(spread[lower], labels[upper], out=spread[lower])
+        spread = np.where(air, spread, empty)
+        spread = np.append(spread.ravel(), empty)[spread]
+        if np.array_equal(spread, labels):
+            break
+        labels = spread
+    touching = []
+    for dx, dy, dz in FACES:
+        side = [slice(None)] * 3
+        axis = 0 if dx else 1 if dy else 2
+        side[axis] = -1 if dx + dy + dz > 0 else 0
+        side = labels[tuple(side)]
+        touching.append(np.unique(side[side != empty]))
+    return tuple(
+        sum(1 << other for other, b in enumerate(touching)
+            if len(a) and len(b) and len(np.intersect1d(a, b)))
+        for a in touching)
+
+
+class SectorGraph(object):
+    """ Which sectors of a `ChunkStore` can be seen from which, for culling
+    sectors hidden behind terrain (Checchi, "Advanced Cave Culling
+    Algorithm").
+
+    Every sector records which of its faces are joined through air, see
+    `face_links()`. A sector can only be seen from the camera if a path of
+    sectors leads there that enters and leaves each of them through joined
+    faces, never turning back towards the camera.
+
+    """
+
+    def __init__(self, world):
+        # The `ChunkStore` the sectors belong to.
+        self.world = world
+
+        # Mapping from sector to its `face_links()`, filled in lazily.
+        self.links = {}
+
+        # Bumped whenever a sector's links may have changed, so results of
+        # `reachable()` can be cached until the next edit.
+        self.version = 0
+
+    def sector_links(self, sector):
+        """ Returns the `face_links()` of `sector`.
+
+        """
+        links = self.links.get(sector)
+        if links is None:
+            size = self.world.size
+            lo = [c * size for c in sector]
+            ids = self.world.region(lo, [c + size for c in lo])
+            links = self.links[sector] = face_links(
+                ids, self.world.types.transparent)
+        return links
+
+    def invalidate(self, sector):
+        """ Forget the links of `sector`, after its blocks changed.
+
+        """
+        self.links.pop(sector, None)
+        self.version += 1
+
+    def forget(self, columns):
+        """ Forget the links of all sectors of `columns`, e.g. when they are
+        dropped from memory. Their blocks did not change, so results of
+        `reachable()` stay valid.
+
+        """
+        columns = set(columns)
+        for sector in list(self.links):
+            if self.world.column(sector) in columns:
+                del self.links[sector]
+
+    def reachable(self, start, sectors):
+        """ Returns the set of `sectors` that may be seen from a camera in
+        the sector `start`, walking the graph breadth first. Only paths
+        through `sectors` are followed.
+
+        """
+        if start not in sectors:
+            return set(sectors)
+        seen = set([start])
+        queue = deque([(start, None, 0)])
+        while queue:
+            sector, entry, directions = queue.popleft()
+            links = self.sector_links(sector)
+            x, y, z = sector
+            for face, (dx, dy, dz) in enumerate(FACES):
+                if directions & (1 << OPPOSITE[face]):
+                    continue
+                if entry is not None and not links[entry] & (1 << face):
+                    continue
+                neighbour = (x + dx, y + dy, z + dz)
+                if neighbour in seen or neighbour not in sectors:
+                    continue
+                seen.add(neighbour)
+                queue.append((neighbour, OPPOSITE[face],
+                              directions | (1 << face)))
+        return seen
@@ -36,8 +36,10 @@ class Player:
     self.movement = [0, 0]
     self.fall_velocity = 0
     self.look = (0, 0)
-    self.inventory = [BRICK, SAND, STONE]
-    self.current_block_texture = self.inventory[0]
+    # Names of the block types the player can place, see `BlockTypes`, and
+    # the type id of the one selected, set by the window.
+    self.inventory = ['brick', 'sand', 'stone']
+    self.current_block = None
   
   def move_forward(self):
     self.movement[0] = -1
@@ -0,0 +1,192 @@
+from __future__ import division
+
+import json
+import time
+from collections import deque
+
+# Weight of the latest frame in the averages shown by `Profiler.report()`.
+SMOOTHING = 0.1
+
+# Most sections kept for `Profiler.export()`; older ones are dropped.
+MAX_EVENTS = 200000
+
+
+class _NullSection(object):
+    """ The section handed out while profiling is off: does nothing.
+
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section(object):
+    """ Times one run of a named section of code, see `Profiler.section()`.
+
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler(object):
+    """ Frame timings and counters of the hot paths of the game.
+
+    Code to time is wrapped in `with PROFILER.section(name):` and per frame
+    quantities are added up with `count()` or set with `gauge()`. `frame()`
+    closes a frame, folding its totals into the averages of `report()`.
+    Every timed section is also kept as an event for `export()`, which
+    writes them as a Chrome trace (chrome://tracing or Perfetto).
+
+    Nothing is recorded while `enabled` is False, see `enable()`, and
+    `section()` then returns a shared object whose `with` block costs next
+    to nothing.
+
+    """
+
+    def __init__(self, enabled=False, max_events=MAX_EVENTS):
+        self.enabled = enabled
+
+        # Seconds spent in and runs of every section in the current frame.
+        self.times = {}
+        self.calls = {}
+
+        # Totals of the counters in the current frame and the last value of
+        # every gauge.
+        self.counters = {}
+        self.gauges = {}
+
+        # Smoothed per frame values of all of the above, see `report()`.
+        self.averages = {}
+
+        # Timed sections and counters as Chrome trace events.
+        self.events = deque(maxlen=max_events)
+
+        # Start of the current frame and of profiling, as
+        # `time.perf_counter()` values.
+        self.frame_start = self.origin = time.perf_counter()
+        self.frames = 0
+
+    def enable(self, enabled=True):
+        """ Turn profiling on or off. The frame in progress when it is turned
+        on is dropped, as only part of it was seen.
+
+        """
+        if enabled and not self.enabled:
+            self.times = {}
+            self.calls = {}
+            self.counters = {}
+            self.frame_start = time.perf_counter()
+        self.enabled = enabled
+
+    def section(self, name):
+        """ Returns a context manager timing the code run within it as the
+        section `name`.
+
+        """
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self, name)
+
+    def _record(self, name, start, end):
+        self.times[name] = self.times.get(name, 0.0) + end - start
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.events.append({
+            'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+        })
+
+    def count(self, name, value=1):
+        """ Add `value` to the counter `name` of the current frame.
+
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """ Set the gauge `name` to `value`, e.g. the length of a queue.
+
+        """
+        if self.enabled:
+            self.gauges[name] = value
+
+    def frame(self):
+        """ Close the current frame and start the next one.
+
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        values = {'frame': now - self.frame_start}
+        for name, seconds in self.times.items():
+            values[name] = seconds
+            values[name + ' calls'] = self.calls[name]
+        values.update(self.counters)
+        values.update(self.gauges)
+        for name, value in values.items():
+            average = self.averages.get(name, value)
+            self.averages[name] = average + SMOOTHING * (value - average)
+        # Sections and counters missing from this frame decay towards 0.
+        for name in set(self.averages) - set(values):
+            self.averages[name] *= 1 - SMOOTHING
+        counters = dict(self.counters)
+        counters.update(self.gauges)
+        if counters:
+            self.events.append({
+                'name': 'counters', 'ph': 'C', 'pid': 0, 'tid': 0,
+                'ts': (now - self.origin) * 1e6, 'args': counters,
+            })
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.frames += 1
+        self.frame_start = now
+
+    def report(self):
+        """ Returns the averages per frame as lines of text, times in
+        milliseconds, slowest sections first.
+
+        """
+        times = [(name, value) for name, value in self.averages.items()
+                 if name == 'frame' or name + ' calls' in self.averages]
+        times.sort(key=lambda item: -item[1])
+        lines = ['%-16s %7.2f ms' % (name, value * 1000)
+                 for name, value in times]
+        lines.extend('%-16s %10.1f' % (name, value) for name, value in
+                     sorted(self.averages.items())
+                     if not name.endswith(' calls') and
+                     name not in dict(times))
+        return lines
+
+    def export(self, path):
+        """ Write the recorded events to `path` as a Chrome trace, with the
+        averages of `report()` under "otherData".
+
+        """
+        with open(path, 'w') as f:
+            json.dump({
+                'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms',
+                'otherData': {'frames': self.frames,
+                              'averages': self.averages},
+            }, f)
+
+
+# The profiler of the game, shared by the window, renderer and simulation.
+PROFILER = Profiler()
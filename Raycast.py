@@ -0,0 +1,179 @@
+from __future__ import division
+
+import math
+
+import numpy as np
+
+from ChunkStore import column_codes
+
+
+def raycast(contains, position, vector, max_distance=8):
+    """ Walk the blocks pierced by a ray in the order it enters them, visiting
+    every block exactly once (Amanatides & Woo, "A Fast Voxel Traversal
+    Algorithm for Ray Tracing").
+
+    Parameters
+    ----------
+    contains : callable
+        Takes an (x, y, z) block position and returns whether the ray stops
+        there.
+    position : tuple of len 3
+        The (x, y, z) position the ray starts from.
+    vector : tuple of len 3
+        The direction of the ray. Need not be normalized.
+    max_distance : float
+        How far away along the ray to search for a hit.
+
+    Returns
+    -------
+    block : tuple of len 3 or None
+        The first block for which `contains` is true, None if there is none.
+    previous : tuple of len 3 or None
+        The block visited right before `block`, or the last block visited when
+        nothing was hit. None if the ray starts inside `block`.
+    face : tuple of len 3 or None
+        The normal of the face of `block` the ray entered through.
+
+    """
+    current = [int(math.floor(c + 0.5)) for c in position]
+    if contains(tuple(current)):
+        return tuple(current), None, None
+    length = math.sqrt(sum(d * d for d in vector))
+    if not length:
+        return None, tuple(current), None
+    step = [0, 0, 0]
+    t_max = [float('inf')] * 3
+    t_delta = [float('inf')] * 3
+    for i in range(3):
+        d = vector[i] / length
+        if d > 0:
+            step[i] = 1
+            t_max[i] = (current[i] + 0.5 - position[i]) / d
+            t_delta[i] = 1 / d
+        elif d < 0:
+            step[i] = -1
+            t_max[i] = (current[i] - 0.5 - position[i]) / d
+            t_delta[i] = -1 / d
+    previous = tuple(current)
+    while True:
+        # Cross the nearest block boundary.
+        i = t_max.index(min(t_max))
+        if t_max[i] > max_distance:
+            return None, previous, None
+        current[i] += step[i]
+        t_max[i] += t_delta[i]
+        block = tuple(current)
+        if contains(block):
+            face = [0, 0, 0]
+            face[i] = -step[i]
+            return block, previous, tuple(face)
+        previous = block
+
+
+def raycast_many(world, positions, vectors, max_distance=8):
+    """ Cast many rays through `world` at once. All rays are stepped in
+    lockstep with NumPy, one block boundary per iteration.
+
+    The columns the rays can reach are copied into one flat array up front,
+    see `ChunkStore.flatten()`, and every ray keeps the index of the column
+    it is in, updated only when it crosses into another column. Looking up
+    the blocks of an iteration is then a single gather.
+
+    Parameters
+    ----------
+    world : ChunkStore
+        The blocks to cast against.
+    positions : array of shape (n, 3)
+        The positions the rays start from.
+    vectors : array of shape (n, 3)
+        The directions of the rays.
+    max_distance : float
+        How far away along each ray to search for a hit.
+
+    Returns
+    -------
+    hit : array of bools of shape (n,)
+        Whether each ray hit a block.
+    blocks : array of ints of shape (n, 3)
+        The block each ray hit, or the last block it visited.
+    previous : array of ints of shape (n, 3)
+        The block visited before `blocks`, equal to `blocks` for rays that
+        start inside a block.
+    faces : array of ints of shape (n, 3)
+        The normal of the face each ray entered its hit block through, zero
+        when there was no hit or the ray starts inside the block.
+
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    count = len(positions)
+    size = world.size
+    current = np.floor(positions + 0.5).astype(np.int64)
+    previous = current.copy()
+    faces = np.zeros((count, 3), dtype=np.int64)
+    length = np.sqrt((vectors ** 2).sum(axis=1))[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = np.where(length > 0, vectors / length, 0)
+        step = np.sign(d).astype(np.int64)
+        t_max = np.where(step != 0,
+                         (current + 0.5 * step - positions) / d, np.inf)
+        t_delta = np.where(step != 0, np.abs(1 / d), np.inf)
+
+    # Every column within the bounding box of each ray, padded by a block
+    # against rounding.
+    end = np.floor(positions + d * max_distance + 0.5).astype(np.int64)
+    lo = (np.minimum(current, end)[:, [0, 2]] - 1) // size
+    hi = (np.maximum(current, end)[:, [0, 2]] + 1) // size
+    spans = hi - lo + 1
+    candidates = np.concatenate([
+        lo[(spans[:, 0] > dx) & (spans[:, 1] > dz)] + (dx, dz)
+        for dx in range(int(spans[:, 0].max(initial=1)))
+        for dz in range(int(spans[:, 1].max(initial=1)))])
+    codes, first = np.unique(column_codes(candidates), return_index=True)
+    blocks, offsets, bases, heights = world.flatten(candidates[first])
+
+    def locate(index):
+        """ Returns the indices into `codes` of the columns of the rays. """
+        return np.searchsorted(codes, column_codes(
+            current[index][:, [0, 2]] // size))
+
+    def lookup(index):
+        """ Returns the block ids at `current[index]`. """
+        slot = slots[index]
+        x, y, z = current[index].T
+        y = y - bases[slot]
+        inside = (y >= 0) & (y < heights[slot])
+        slot = slot[inside]
+        ids = np.zeros(len(index), dtype=np.uint8)
+        ids[inside] = blocks[offsets[slot] + ((x[inside] % size) *
+                                              heights[slot] + y[inside]) *
+                             size + z[inside] % size]
+        return ids
+
+    # Index into `codes` of the column every ray is in.
+    slots = locate(np.arange(count))
+    hit = lookup(np.arange(count)) != 0
+    active = ~hit
+    while active.any():
+        index = np.nonzero(active)[0]
+        axis = t_max[index].argmin(axis=1)
+        near = t_max[index, axis]
+        # Rays whose next boundary is out of reach are done.
+        done = near > max_distance
+        active[index[done]] = False
+        index, axis = index[~done], axis[~done]
+        if not len(index):
+            break
+        previous[index] = current[index]
+        current[index, axis] += step[index, axis]
+        t_max[index, axis] += t_delta[index, axis]
+        moved = index[(axis != 1) & (current[index, axis] % size ==
+                                     np.where(step[index, axis] > 0, 0,
+                                              size - 1))]
+        slots[moved] = locate(moved)
+        found = lookup(index) != 0
+        index, axis = index[found], axis[found]
+        hit[index] = True
+        active[index] = False
+        faces[index, axis] = -step[index, axis]
+    return hit, current, previous, faces
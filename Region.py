@@ -0,0 +1,328 @@
+from __future__ import division
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from ChunkStore import Chunk
+
+# Every region file holds REGION_SIZE x REGION_SIZE sectors.
+REGION_SIZE = 32
+
+# Layout of a region file:
+#
+#   0     header: magic, version, sector size, base y and height of records
+#   4096  slot table: uint32 per sector of the region, row-major in (x, z),
+#         holding 1 + the index of its record or 0 for an empty sector
+#   8192  records: the block ids then the face masks of one sector, each a
+#         (size, height, size) uint8 array covering world y base to
+#         base + height
+#
+# Records have a fixed size, so a sector is found with one table lookup and
+# read straight from the memory map without touching the rest of the file.
+MAGIC = b'MINEREG\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIiI')
+TABLE = 4096
+DATA = TABLE + 4 * REGION_SIZE ** 2
+
+# Default vertical range stored for every sector. A region file with a
+# sector reaching outside of its range is rewritten with a range grown to
+# multiples of HEIGHT_STEP, see `RegionFile.grow()`.
+BASE = -32
+HEIGHT = 128
+HEIGHT_STEP = 64
+
+PALETTE = 'palette.json'
+SETTINGS = 'world.json'
+
+
+class RegionFile(object):
+    """ One region file, memory-mapped so that reading a sector only pages in
+    that sector's record.
+
+    """
+
+    def __init__(self, path, size, base=BASE, height=HEIGHT):
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, size, base, height))
+                f.truncate(DATA)
+        self.path = path
+        self._open()
+
+    def _open(self):
+        path = self.path
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, size, base, height = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a region file' % path)
+        self.size = size
+        self.base = base
+        self.height = height
+        self.record_size = 2 * size * height * size
+
+        # Record index of every sector of the region, -1 when it is empty.
+        self.slots = np.frombuffer(self._map, dtype='<u4',
+                                   count=REGION_SIZE ** 2, offset=TABLE)
+        self.slots = self.slots.astype(np.int64).reshape(
+            REGION_SIZE, REGION_SIZE) - 1
+
+        # Records no longer used by any sector, reused before the file grows.
+        records = (len(self._map) - DATA) // self.record_size
+        self._free = sorted(set(range(records)) - set(self.slots.ravel()))
+
+    def __contains__(self, slot):
+        return self.slots[slot] >= 0
+
+    def _record(self, index):
+        """ Returns the (blocks, faces) arrays of record `index`. They are
+        views of the memory map and must not outlive a resize.
+
+        """
+        shape = (self.size, self.height, self.size)
+        offset = DATA + index * self.record_size
+        data = np.frombuffer(self._map, dtype=np.uint8,
+                             count=self.record_size, offset=offset)
+        return data[:self.record_size // 2].reshape(shape), \
+            data[self.record_size // 2:].reshape(shape)
+
+    def _set_slot(self, slot, index):
+        self.slots[slot] = index
+        offset = TABLE + 4 * (slot[0] * REGION_SIZE + slot[1])
+        struct.pack_into('<I', self._map, offset, index + 1)
+
+    def _allocate(self):
+        """ Returns the index of an unused record, growing the file when
+        there is none.
+
+        """
+        if self._free:
+            return self._free.pop(0)
+        index = (len(self._map) - DATA) // self.record_size
+        self._map.close()
+        self._file.truncate(DATA + (index + 1) * self.record_size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        return index
+
+    def load(self, slot):
+        """ Returns a `Chunk` with the blocks of `slot`, or None if the sector
+        is empty.
+
+        """
+        index = self.slots[slot]
+        if index < 0:
+            return None
+        blocks, faces = self._record(index)
+        rows = np.nonzero(blocks.any(axis=(0, 2)))[0]
+        if not len(rows):
+            return None
+        chunk = Chunk(self.size)
+        chunk.fit(self.base + rows[0])
+        chunk.fit(self.base + rows[-1])
+        lo = max(chunk.base, self.base) - self.base
+        hi = min(chunk.top, self.base + self.height) - self.base
+        start = self.base + lo - chunk.base
+        chunk.blocks[:, start:start + hi - lo, :] = blocks[:, lo:hi, :]
+        chunk.faces[:, start:start + hi - lo, :] = faces[:, lo:hi, :]
+        chunk.count = int(np.count_nonzero(chunk.blocks))
+        chunk.recount()
+        return chunk
+
+    def save(self, slot, chunk):
+        """ Write `chunk` into the record of `slot`. A `chunk` of None frees
+        the record.
+
+        """
+        index = self.slots[slot]
+        if chunk is None:
+            if index >= 0:
+                self._set_slot(slot, -1)
+                self._free.append(index)
+            return
+        rows = np.nonzero(chunk.blocks.any(axis=(0, 2)))[0]
+        if len(rows) and (chunk.base + rows[0] < self.base or
+                          chunk.base + rows[-1] >= self.base + self.height):
+            self.grow(chunk.base + rows[0], chunk.base + rows[-1] + 1)
+            index = self.slots[slot]
+        if index < 0:
+            index = self._allocate()
+            self._set_slot(slot, index)
+        blocks, faces = self._record(index)
+        blocks[...] = 0
+        faces[...] = 0
+        lo = max(chunk.base, self.base)
+        hi = min(chunk.top, self.base + self.height)
+        if lo < hi:
+            blocks[:, lo - self.base:hi - self.base, :] = \
+                chunk.blocks[:, lo - chunk.base:hi - chunk.base, :]
+            faces[:, lo - self.base:hi - self.base, :] = \
+                chunk.faces[:, lo - chunk.base:hi - chunk.base, :]
+        del blocks, faces
+        offset = DATA + index * self.record_size
+        self._map.flush(offset - offset % mmap.ALLOCATIONGRANULARITY,
+                        self.record_size + offset % mmap.ALLOCATIONGRANULARITY)
+
+    def grow(self, lo, hi):
+        """ Rewrite the file so that its records cover world heights `lo` to
+        `hi` as well as the range they cover now.
+
+        The new file is written next to the old one and then moved over it,
+        so a failure part way leaves the old file intact.
+
+        """
+        base = min(self.base, (lo // HEIGHT_STEP) * HEIGHT_STEP)
+        top = max(self.base + self.height,
+                  -(-hi // HEIGHT_STEP) * HEIGHT_STEP)
+        start = self.base - base
+        path = self.path + '.tmp'
+        if os.path.exists(path):
+            os.remove(path)
+        grown = RegionFile(path, self.size, base, top - base)
+        for slot in zip(*np.nonzero(self.slots >= 0)):
+            index = grown._allocate()
+            grown._set_slot(slot, index)
+            old = self._record(self.slots[slot])
+            new = grown._record(index)
+            for source, target in zip(old, new):
+                target[:, start:start + self.height, :] = source
+            del old, new, source, target
+        grown.close()
+        self.close()
+        os.replace(path, self.path)
+        self._open()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class RegionStore(object):
+    """ A world saved to a directory of region files, see `RegionFile`.
+
+    Attach it to a `ChunkStore` with `attach()` and the sectors are loaded
+    lazily the first time they are looked up, so only the sectors around the
+    player are ever read. `save()` writes back just the sectors edited since
+    the last save.
+
+    Sectors never saved are loaded from `fallback` if given, e.g. a
+    `Terrain.Generator` for an endless world, so only the sectors edited by
+    the player take up space on disk.
+
+    """
+
+    def __init__(self, path, size, base=BASE, height=HEIGHT, fallback=None):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.size = size
+        self.base = base
+        self.height = height
+        self.fallback = fallback
+
+        # Mapping from region to its `RegionFile`, None when it has no file.
+        self.regions = {}
+
+        # Palette of the saved block ids, empty for a new world.
+        self.palette = []
+        palette = os.path.join(path, PALETTE)
+        if os.path.exists(palette):
+            with open(palette) as f:
+                self.palette = [None] + json.load(f)
+
+        # Settings the world was created with, e.g. the seed of its terrain.
+        self.settings = {}
+        settings = os.path.join(path, SETTINGS)
+        if os.path.exists(settings):
+            with open(settings) as f:
+                self.settings = json.load(f)
+        self._settings = dict(self.settings)
+
+    def _region(self, sector, create=False):
+        """ Returns the `RegionFile` containing `sector` and the slot of the
+        sector in it. The file is None if it does not exist and `create` is
+        False.
+
+        """
+        x, y, z = sector
+        key = (x // REGION_SIZE, z // REGION_SIZE)
+        region = self.regions.get(key)
+        if region is None and (create or key not in self.regions):
+            path = os.path.join(self.path, 'r.%d.%d.region' % key)
+            if create or os.path.exists(path):
+                region = RegionFile(path, self.size, self.base, self.height)
+            self.regions[key] = region
+        return region, (x % REGION_SIZE, z % REGION_SIZE)
+
+    def __contains__(self, sector):
+        region, slot = self._region(sector)
+        if region is not None and slot in region:
+            return True
+        return self.fallback is not None and sector in self.fallback
+
+    def load(self, sector):
+        """ Returns the `Chunk` of `sector`, None if it is empty.
+
+        """
+        region, slot = self._region(sector)
+        if region is not None and slot in region:
+            return region.load(slot)
+        if self.fallback is not None:
+            return self.fallback.load(sector)
+        return None
+
+    def attach(self, world):
+        """ Load sectors of `world`, a `ChunkStore`, from this store from now
+        on. The saved palette is interned into the world first, so the block
+        ids in the files keep their meaning.
+
+        """
+        for block_id, texture in enumerate(self.palette[1:], 1):
+            if world.block_id(texture) != block_id:
+                raise ValueError('palette of %s does not match the world' %
+                                 self.path)
+        world.source = self
+
+    def save(self, world, sectors=None):
+        """ Write back the sectors of `world` edited since the last save, or
+        the given `sectors`.
+
+        Returns
+        -------
+        count : int
+            The number of sectors written.
+
+        """
+        if sectors is None:
+            sectors = world.modified
+        sectors = list(sectors)
+        if len(world.palette) != len(self.palette):
+            self.palette = list(world.palette)
+            with open(os.path.join(self.path, PALETTE), 'w') as f:
+                json.dump(self.palette[1:], f)
+        if self.settings != self._settings:
+            self._settings = dict(self.settings)
+            with open(os.path.join(self.path, SETTINGS), 'w') as f:
+                json.dump(self.settings, f)
+        for sector in sectors:
+            chunk = world.chunks.get(sector)
+            if chunk is None and self.fallback is not None:
+                # Keep an empty record, else the sector would be loaded from
+                # the fallback again.
+                chunk = Chunk(self.size)
+            region, slot = self._region(sector, create=chunk is not None)
+            if region is not None:
+                region.save(slot, chunk)
+        world.modified.difference_update(sectors)
+        return len(sectors)
+
+    def close(self):
+        for region in self.regions.values():
+            if region is not None:
+                region.close()
+        self.regions = {}
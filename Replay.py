@@ -0,0 +1,203 @@
+""" Record the input of a play session and replay it headless.
+
+`main.py --record session.json` writes every input of a game to a file,
+stamped with the tick of the simulation it arrived before. While recording,
+the game steps the simulation at a fixed `dt`, so replaying the file does
+exactly the same work:
+
+    $ python Replay.py session.json --output replay.json
+
+The replay runs as fast as it can without a window and reports the time
+taken by every tick. With `--mesh` it also builds the meshes the renderer
+would build each tick.
+
+"""
+from __future__ import division
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from Mesher import SectorMesher
+from Model import Model, nearby_levels, sectorize
+from Simulation import TICKS_PER_SEC, Simulation
+
+VERSION = 1
+
+
+def apply(simulation, action, args):
+    """ Apply the recorded input `action` with `args` to `simulation`, see
+    `Recorder.record()`.
+
+    """
+    if action == 'strafe':
+        simulation.strafe[:] = args
+    elif action == 'flying':
+        simulation.flying, = args
+    elif action in ('jump', 'look', 'select', 'place_block', 'break_block'):
+        getattr(simulation, action)(*args)
+    else:
+        raise ValueError('unknown action %r' % action)
+
+
+class Recorder(object):
+    """ Records the input given to a `Simulation` as it is stepped.
+
+    Call `record()` after every input and `tick()` after every step. The
+    world is replayed from the seed it was generated from, so edits saved in
+    the region files of a world before the recording are not part of it.
+
+    """
+
+    def __init__(self, simulation, dt=1.0 / TICKS_PER_SEC):
+        model = simulation.model
+
+        # Everything needed to start the same simulation again.
+        self.start = {
+            'world_size': model.world_size,
+            'hills': model.hills,
+            'seed': model.seed,
+            'position': list(simulation.position),
+            'rotation': list(simulation.rotation),
+            'flying': simulation.flying,
+        }
+
+        # Duration of every step.
+        self.dt = dt
+
+        # Number of steps taken so far.
+        self.ticks = 0
+
+        # List of [tick, action, args] in the order they were given.
+        self.events = []
+
+    def record(self, action, *args):
+        """ Record the input `action`, see `apply()`, as given before the
+        next step.
+
+        """
+        self.events.append([self.ticks, action, list(args)])
+
+    def tick(self):
+        self.ticks += 1
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'version': VERSION,
+                'dt': self.dt,
+                'ticks': self.ticks,
+                'start': self.start,
+                'events': self.events,
+            }, f)
+
+
+def load(path):
+    """ Returns the recording saved to `path` by `Recorder.save()`.
+
+    """
+    with open(path) as f:
+        recording = json.load(f)
+    if recording.get('version') != VERSION:
+        raise ValueError('%s is not a recording' % path)
+    return recording
+
+
+def replay(recording, mesh=False):
+    """ Replay `recording` from a new world, stepping as fast as possible.
+
+    Parameters
+    ----------
+    recording : dict
+        See `load()`.
+    mesh : bool
+        Whether to also build the meshes of the sectors the renderer would
+        show or rebuild every tick.
+
+    Returns
+    -------
+    seconds : array of floats
+        The time taken by every tick.
+    simulation : Simulation
+        The simulation at the end of the replay.
+
+    """
+    start = recording['start']
+    model = Model(world_size=start['world_size'], hills=start['hills'],
+                  seed=start['seed'])
+    simulation = Simulation(model)
+    simulation.position = tuple(start['position'])
+    simulation.rotation = tuple(start['rotation'])
+    simulation.flying = start['flying']
+    mesher = SectorMesher(model.world) if mesh else None
+    levels = {}
+    sector = None
+    dt = recording['dt']
+    events = recording['events']
+    seconds = np.zeros(recording['ticks'])
+    index = 0
+    for tick in range(recording['ticks']):
+        begin = time.perf_counter()
+        while index < len(events) and events[index][0] == tick:
+            apply(simulation, events[index][1], events[index][2])
+            index += 1
+        if mesher is not None:
+            # The sectors `Renderer.change_sectors()` and
+            # `Renderer.process_dirty()` would mesh.
+            current = sectorize(simulation.position)
+            show = set()
+            if current != sector:
+                sector = current
+                after = nearby_levels(sector)
+                show.update(s for s, l in after.items()
+                            if levels.get(s) != l)
+                levels = after
+            show.update(s for s in model.dirty if s in levels)
+            model.dirty.clear()
+            for s in show:
+                mesher.mesh(s, levels[s])
+        simulation.step(dt)
+        seconds[tick] = time.perf_counter() - begin
+    return seconds, simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('recording', help='file written by main.py --record')
+    parser.add_argument('--mesh', action='store_true',
+                        help='also build the meshes of shown sectors')
+    parser.add_argument('--output', help='write the tick times as JSON here')
+    args = parser.parse_args()
+
+    recording = load(args.recording)
+    seconds, simulation = replay(recording, args.mesh)
+    milliseconds = seconds * 1000
+    results = [
+        ('ticks', len(seconds), ''),
+        ('total', seconds.sum(), 's'),
+        ('mean', milliseconds.mean() if len(seconds) else 0, 'ms'),
+    ]
+    for p in (50, 95, 99, 100):
+        results.append(('p%d' % p, np.percentile(milliseconds, p)
+                        if len(seconds) else 0, 'ms'))
+    for name, value, unit in results:
+        print('%-10s %12.4f %s' % (name, value, unit))
+    # Replays of the same recording must end in the same state.
+    print('position   %s' % (simulation.position,))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'recording': args.recording,
+                'mesh': args.mesh,
+                'results': dict((name, {'value': float(value), 'unit': unit})
+                                for name, value, unit in results),
+                'position': list(simulation.position),
+                'blocks': len(simulation.model.world),
+                'tick_seconds': seconds.tolist(),
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
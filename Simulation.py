@@ -0,0 +1,226 @@
+from __future__ import division
+
+import math
+
+from Collision import extents, sweep
+from FallingBlocks import FallingBlocks
+from Model import Model
+from Profiler import PROFILER
+
+TICKS_PER_SEC = 60
+
+WALKING_SPEED = 5
+FLYING_SPEED = 15
+
+GRAVITY = 20.0
+MAX_JUMP_HEIGHT = 1.0  # About the height of a block.
+
+JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
+TERMINAL_VELOCITY = 50
+
+PLAYER_HEIGHT = 2
+
+# Collision box of the player, see `Collision.extents()`. The pad is how much
+# overlap with a surrounding block you need to have to count as a collision.
+# If 0, touching terrain at all counts as a collision. If .49, you sink into
+# the ground, as if walking through tall grass. If >= .5, you'll fall through
+# the ground.
+PLAYER_BOX = extents(PLAYER_HEIGHT, pad=0.1)
+
+
+class Simulation(object):
+    """ The game state without any windowing or OpenGL: the world model, the
+    player and the falling blocks. It can be stepped at any rate, and a
+    window only has to render it and forward input to it.
+
+    """
+
+    def __init__(self, model=None):
+
+        # Instance of the model that handles the world.
+        self.model = model if model is not None else Model()
+
+        # When flying gravity has no effect and speed is increased.
+        self.flying = False
+
+        # Strafing is moving lateral to the direction you are facing,
+        # e.g. moving to the left or right while continuing to face forward.
+        #
+        # First element is -1 when moving forward, 1 when moving back, and 0
+        # otherwise. The second element is -1 when moving left, 1 when moving
+        # right, and 0 otherwise.
+        self.strafe = [0, 0]
+
+        # Current (x, y, z) position in the world, specified with floats. Note
+        # that, perhaps unlike in math class, the y-axis is the vertical axis.
+        self.position = (0, 0, 0)
+
+        # First element is rotation of the player in the x-z plane (ground
+        # plane) measured from the z-axis down. The second is the rotation
+        # angle from the ground plane up. Rotation is in degrees.
+        #
+        # The vertical plane rotation ranges from -90 (looking straight down) to
+        # 90 (looking straight up). The horizontal rotation range is unbounded.
+        self.rotation = (0, 0)
+
+        # Velocity in the y (upward) direction.
+        self.dy = 0
+
+        # A list of the block types the player can place, see `BlockTypes`.
+        # Hit num keys to cycle.
+        types = self.model.world.types
+        self.inventory = [types.named(name) for name in
+                          ('brick', 'grass', 'sand')]
+
+        # The current block the user can place. Hit num keys to cycle.
+        self.block = self.inventory[0]
+
+        # Blocks falling through the air. They are only added to the model
+        # once they land.
+        self.falling = FallingBlocks()
+
+    def get_sight_vector(self):
+        """ Returns the current line of sight vector indicating the direction
+        the player is looking.
+
+        """
+        x, y = self.rotation
+        # y ranges from -90 to 90, or -pi/2 to pi/2, so m ranges from 0 to 1 and
+        # is 1 when looking ahead parallel to the ground and 0 when looking
+        # straight up or down.
+        m = math.cos(math.radians(y))
+        # dy ranges from -1 to 1 and is -1 when looking straight down and 1 when
+        # looking straight up.
+        dy = math.sin(math.radians(y))
+        dx = math.cos(math.radians(x - 90)) * m
+        dz = math.sin(math.radians(x - 90)) * m
+        return (dx, dy, dz)
+
+    def get_motion_vector(self):
+        """ Returns the current motion vector indicating the velocity of the
+        player.
+
+        Returns
+        -------
+        vector : tuple of len 3
+            Tuple containing the velocity in x, y, and z respectively.
+
+        """
+        if any(self.strafe):
+            x, y = self.rotation
+            strafe = math.degrees(math.atan2(*self.strafe))
+            y_angle = math.radians(y)
+            x_angle = math.radians(x + strafe)
+            if self.flying:
+                m = math.cos(y_angle)
+                dy = math.sin(y_angle)
+                if self.strafe[1]:
+                    # Moving left or right.
+                    dy = 0.0
+                    m = 1
+                if self.strafe[0] > 0:
+                    # Moving backwards.
+                    dy *= -1
+                # When you are flying up or down, you have less left and right
+                # motion.
+                dx = math.cos(x_angle) * m
+                dz = math.sin(x_angle) * m
+            else:
+                dy = 0.0
+                dx = math.cos(x_angle)
+                dz = math.sin(x_angle)
+        else:
+            dy = 0.0
+            dx = 0.0
+            dz = 0.0
+        return (dx, dy, dz)
+
+    def step(self, dt):
+        """ Advance the simulation by `dt` seconds. This is where most of the
+        motion logic lives, along with gravity and collision detection.
+        Collisions are swept over the whole move, so a single step cannot
+        tunnel through blocks even at TERMINAL_VELOCITY.
+
+        Parameters
+        ----------
+        dt : float
+            The change in time since the last call. Clamped to 0.2 seconds.
+
+        """
+        dt = min(dt, 0.2)
+        # walking
+        speed = FLYING_SPEED if self.flying else WALKING_SPEED
+        d = dt * speed  # distance covered this tick.
+
+        # falling blocks
+        with PROFILER.section('falling'):
+            landed = self.falling.step(self.model.world, dt, GRAVITY,
+                                       TERMINAL_VELOCITY)
+        for position, block_id in landed:
+            self.model.add_block(position, block_id)
+
+        dx, dy, dz = self.get_motion_vector()
+        # New position in space, before accounting for gravity.
+        dx, dy, dz = dx * d, dy * d, dz * d
+        # gravity
+        if not self.flying:
+            # Update your vertical speed: if you are falling, speed up until you
+            # hit terminal velocity; if you are jumping, slow down until you
+            # start falling.
+            self.dy -= dt * GRAVITY
+            self.dy = max(self.dy, -TERMINAL_VELOCITY)
+            dy += self.dy * dt
+        # collisions
+        with PROFILER.section('collide'):
+            self.position, normals = sweep(
+                self.model.world, self.position, (dx, dy, dz), PLAYER_BOX)
+        if (0, 1, 0) in normals or (0, -1, 0) in normals:
+            # You are colliding with the ground or ceiling, so stop falling /
+            # rising.
+            self.dy = 0
+
+    def jump(self):
+        """ Start a jump if the player is standing on the ground.
+
+        """
+        if self.dy == 0:
+            self.dy = JUMP_SPEED
+
+    def look(self, dx, dy):
+        """ Turn the player's view by `dx` and `dy` degrees.
+
+        """
+        x, y = self.rotation
+        x, y = x + dx, y + dy
+        y = max(-90, min(90, y))
+        self.rotation = (x, y)
+
+    def select(self, index):
+        """ Make the inventory item at `index` the block the player places.
+
+        """
+        self.block = self.inventory[index % len(self.inventory)]
+
+    def place_block(self):
+        """ Place the current block in front of the block the player looks
+        at. Looking at nothing drops the block from mid-air.
+
+        """
+        vector = self.get_sight_vector()
+        block, previous, face = self.model.hit_test(self.position, vector)
+        if block is None:  # block is created on the air
+            self.falling.add(previous, self.block)
+        elif previous:
+            self.model.add_block(previous, self.block)
+
+    def break_block(self):
+        """ Remove the block the player looks at, unless its type is not
+        breakable, like stone.
+
+        """
+        vector = self.get_sight_vector()
+        block, previous, face = self.model.hit_test(self.position, vector)
+        if block:
+            world = self.model.world
+            if world.types.breakable[world.get_id(block)]:
+                self.model.remove_block(block)
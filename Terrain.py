@@ -0,0 +1,187 @@
+from __future__ import division
+
+import random
+
+import numpy as np
+
+from ChunkStore import Chunk, face_masks
+
+
+def generate(n, ground, wall, hill_textures, hills=120, wall_height=3,
+             rng=random):
+    """ Generate the default world as a dense array.
+
+    The layout is the flat world of grass over stone, walled in at the
+    border, with randomly placed round hills on top. Random numbers are drawn
+    from `rng` in the same order as the original block-by-block generator, so
+    a given seed always yields the same world.
+
+    Parameters
+    ----------
+    n : int
+        1/2 width and height of the world.
+    ground : object
+        Texture of the top ground layer.
+    wall : object
+        Texture of the bottom ground layer and the outer walls.
+    hill_textures : list
+        Textures hills are randomly made of.
+    hills : int
+        Number of hills to generate.
+    wall_height : int
+        Height of the outer walls above y = 0.
+    rng : random.Random or module
+        Source of random numbers.
+
+    Returns
+    -------
+    lo : tuple of len 3
+        The position of `volume[0, 0, 0]`.
+    volume : 3D array of ints
+        Indices into `palette`, 0 where there is no block.
+    palette : list
+        The texture of every index, starting with None for empty space.
+
+    """
+    palette = [None, ground, wall] + list(hill_textures)
+    max_hill = 6
+    lo = (-n, -3, -n)
+    volume = np.zeros((2 * n + 1, max(wall_height, max_hill - 1) + 3,
+                       2 * n + 1), dtype=np.uint8)
+    # create a layer stone an grass everywhere.
+    volume[:, -2 - lo[1], :] = 1
+    volume[:, -3 - lo[1], :] = 2
+    # create outer walls.
+    walls = volume[:, -2 - lo[1]:wall_height - lo[1], :]
+    walls[[0, -1], :, :] = 2
+    walls[:, :, [0, -1]] = 2
+
+    # generate the hills randomly
+    o = n - 10
+    for _ in range(hills):
+        a = rng.randint(-o, o)  # x position of the hill
+        b = rng.randint(-o, o)  # z position of the hill
+        h = rng.randint(1, max_hill)  # height of the hill
+        s = rng.randint(4, 8)  # 2 * s is the side length of the hill
+        t = 3 + hill_textures.index(rng.choice(hill_textures))
+        stamp_hill(volume, lo, a, b, h, s, t)
+    return lo, volume, palette
+
+
+def stamp_hill(volume, lo, a, b, h, s, t):
+    """ Draw a round hill into `volume`, clipped to its bounds.
+
+    Parameters
+    ----------
+    volume : 3D array of ints
+        The blocks to draw into.
+    lo : tuple of len 3
+        The position of `volume[0, 0, 0]`.
+    a, b : int
+        x and z position of the center of the hill.
+    h : int
+        Height of the hill.
+    s : int
+        2 * s is the side length of the hill.
+    t : int
+        The value to fill the hill with.
+
+    """
+    c = -1  # base of the hill
+    d = 1  # how quickly to taper off the hills
+    for y in range(c, c + h):
+        if s < 0:
+            break
+        x0, x1 = max(a - s, lo[0]), min(a + s + 1, lo[0] + volume.shape[0])
+        z0, z1 = max(b - s, lo[2]), min(b + s + 1, lo[2] + volume.shape[2])
+        if x0 < x1 and z0 < z1 and 0 <= y - lo[1] < volume.shape[1]:
+            x, z = np.ogrid[x0:x1, z0:z1]
+            # kind of circular shape, but cannot be close to the corner
+            mask = ((x - a) ** 2 + (z - b) ** 2 <= (s + 1) ** 2) & \
+                (x ** 2 + z ** 2 >= 5 ** 2)
+            layer = volume[x0 - lo[0]:x1 - lo[0], y - lo[1],
+                           z0 - lo[2]:z1 - lo[2]]
+            layer[mask] = t
+        s -= d  # decrement side length so hills taper off
+
+
+class Generator(object):
+    """ Generates the columns of an endless world on demand: grass over
+    stone everywhere with round hills on top, like `generate()` without the
+    outer walls.
+
+    Each column is derived only from the seed and the positions of itself
+    and its neighbours, so columns come out the same in any order and can be
+    dropped and generated again at will. It can serve as the `source` of a
+    `ChunkStore`.
+
+    """
+
+    def __init__(self, size, ground, wall, hill_ids, seed=0, max_hills=2,
+                 types=None):
+        # Edge length of a column.
+        self.size = size
+
+        # Block ids of the top and bottom ground layers and of the hills.
+        self.ground = ground
+        self.wall = wall
+        self.hill_ids = list(hill_ids)
+
+        self.seed = seed
+
+        # Up to this many hills are centered on every column.
+        self.max_hills = max_hills
+
+        # The `BlockTypes` the ids stand for, to tell which faces are seen
+        # through transparent blocks. None when all blocks are opaque.
+        self.types = types
+
+    def __contains__(self, column):
+        return True
+
+    def _hills(self, column):
+        """ Returns the hills centered on `column` as (a, b, h, s, t) tuples,
+        see `stamp_hill()`.
+
+        """
+        x, _, z = column
+        rng = random.Random('%s:%d:%d' % (self.seed, x, z))
+        hills = []
+        for _ in range(rng.randint(0, self.max_hills)):
+            a = x * self.size + rng.randrange(self.size)
+            b = z * self.size + rng.randrange(self.size)
+            h = rng.randint(1, 6)
+            s = rng.randint(4, 8)
+            hills.append((a, b, h, s, rng.choice(self.hill_ids)))
+        return hills
+
+    def load(self, column):
+        """ Returns a new `Chunk` with the blocks of `column`.
+
+        """
+        x, _, z = column
+        size = self.size
+        # The column with a margin of one block all around, so the faces on
+        # its sides can be told apart from those hidden by its neighbours.
+        lo = (x * size - 1, -4, z * size - 1)
+        volume = np.zeros((size + 2, 10, size + 2), dtype=np.uint8)
+        volume[:, -3 - lo[1], :] = self.wall
+        volume[:, -2 - lo[1], :] = self.ground
+        # Hills are at most 8 blocks wide on either side, so only those of
+        # the neighbouring columns can reach into this one.
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                for hill in self._hills((x + dx, 0, z + dz)):
+                    stamp_hill(volume, lo, *hill)
+        chunk = Chunk(size)
+        chunk.fit(lo[1] + 1)
+        chunk.fit(lo[1] + volume.shape[1] - 2)
+        start = lo[1] + 1 - chunk.base
+        height = volume.shape[1] - 2
+        chunk.blocks[:, start:start + height, :] = volume[1:-1, 1:-1, 1:-1]
+        transparent = None if self.types is None else self.types.transparent
+        chunk.faces[:, start:start + height, :] = face_masks(volume,
+                                                             transparent)
+        chunk.count = int(np.count_nonzero(chunk.blocks))
+        chunk.recount()
+        return chunk
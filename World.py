@@ -1,4 +1,7 @@
-import random
+import time
+from collections import deque
+
+import numpy as np
 
 from pyglet import image
 from pyglet.graphics import TextureGroup, Batch
@@ -7,85 +10,249 @@ from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
 from Block import *
+from BlockTypes import BlockTypes
 from Player import *
+import Terrain
+from Raycast import raycast
 
 def normalize(position):
   x, y, z = position
   x, y, z = (int(round(x)), int(round(y)), int(round(z)))
   return (x, y, z)
 
+# Blocks are shown and hidden a sector of SECTOR_SIZE x SECTOR_SIZE columns
+# at a time, see `World.change_sectors()`.
+SECTOR_SIZE = 16
+
+def sectorize(position):
+  x, y, z = normalize(position)
+  return (x // SECTOR_SIZE, 0, z // SECTOR_SIZE)
+
 TEXTURE_PATH = 'texture1.png'
 
+def block_types():
+  types = BlockTypes()
+  types.define('grass', GRASS)
+  types.define('sand', SAND)
+  types.define('brick', BRICK)
+  types.define('stone', STONE, breakable=False)
+  return types
+
 class World(object):
+  """ The blocks of the world and the batch they are drawn from.
+
+  Only exposed blocks in the sectors around the player are in the batch, so
+  drawing costs what is visible rather than what was ever placed. Call
+  `change_sectors()` when the player moves to another sector and
+  `process_queue()` every tick.
 
-  def __init__(self):
+  """
+
+  def __init__(self, n=50, hills=50):
     self.batch = Batch()
     self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
+    # Kinds of blocks, see `BlockTypes`.
+    self.types = block_types()
+    # Blocks at rest by key, see `Block.pack()`, and the type id of each.
     self.world_blocks = set()
-    self.block_to_texture = {}
+    self.block_ids = {}
+    # Type id of the blocks to draw, and the vertex lists of those drawn so
+    # far. They differ while the queue is being worked through.
+    self.shown = {}
     self.block_to_vList = {}
+    # Keys of the blocks in every sector, see `sectorize()`.
+    self.sectors = {}
+    # Calls to `_show_block()` and `_hide_block()` not made yet.
+    self.queue = deque()
+    # Handles of the falling blocks, which are not in `world_blocks`.
     self.on_air = set()
-    self._initialize()
-
-  def _initialize(self):
-    n = 50  
-    y = 0  
-    for x in range(-n, n + 1, 1):
-      for z in range(-n, n + 1, 1):
-        grass_block = Block((x, y - 2, z))
-        stone_block = Block((x, y - 3, z))
-        self.block_to_texture[grass_block] = GRASS
-        self.block_to_texture[stone_block] = STONE
-        self.add_block(grass_block)
-        self.add_block(stone_block)
-        if x in (-n, n) or z in (-n, n):
-          for dy in range(-2, 5):      
-            self.block_to_texture[Block((x, y + dy, z))] = STONE
-            self.add_block(Block((x, y + dy, z)))
-
-    o = n - 10
-    for _ in range(50):
-      x_pos = random.randint(-o, o)  
-      z_pos = random.randint(-o, o)  
-      h = random.randint(1, 6)  
-      s = random.randint(4, 8)  
-      t = random.choice([GRASS, SAND, BRICK])
-      for y in range(-1, h - 1):
-        for x in range(x_pos - s, x_pos + s + 1):
-          for z in range(z_pos - s, z_pos + s + 1):
-            if (x - x_pos) ** 2 + (z - z_pos) ** 2 > (s + 1) ** 2:  # kind of circular shape
-              continue
-            if (x - 0) ** 2 + (z - 0) ** 2 < 5 ** 2:  # cannot be close to the corner
-              continue
-            random_block = Block((x, y, z))
-            self.block_to_texture[random_block] = t
-            self.add_block(random_block)
-        s -= 1
-
-  def ray_trace(self, position, vector):
-    x, y, z = position
-    dx, dy, dz = vector
-    previous_pos = None
-    hit_block = Block()
-    max_distance=8
-    for _ in range(max_distance * 8):
-      hit_block.setPosition(normalize((x, y, z)))
-      if hit_block.getPosition != previous_pos and hit_block in self.world_blocks:
-        return hit_block, previous_pos
-      previous_pos = hit_block.getPosition()
-      x, y, z = x + dx / 8, y + dy / 8, z + dz / 8
-    return None, previous_pos
-
-  def add_block(self, block : Block):
-    if block in self.world_blocks:
-      self.remove_block(block)
-    self.world_blocks.add(block)
-    vertex_data = block.getVertices()
-    texture_data = list(self.block_to_texture[block])
-    self.block_to_vList[block] = self.batch.add(24, GL_QUADS, self.group,
-                                              ('v3f/static', vertex_data),
-                                              ('t2f/static', texture_data))
-
-  def remove_block(self, block : Block):
-    self.world_blocks.remove(block)
-    self.block_to_vList[block].delete()
+    self._initialize(n, hills)
+
+  def _initialize(self, n, hills):
+    """ Insert the generated terrain in bulk. Blocks are drawn once their
+    sector is shown, see `show_sector()`, which is when their exposure is
+    checked.
+
+    """
+    lo, volume, palette = Terrain.generate(
+      n, GRASS, STONE, [GRASS, SAND, BRICK], hills=hills, wall_height=5)
+    lookup = np.array([0] + [self.types.id(texture) for texture in palette[1:]])
+    cells = np.nonzero(volume)
+    positions = np.column_stack(cells) + lo
+    keys = pack_many(positions)
+    ids = lookup[volume[cells]]
+    key_list = keys.tolist()
+    self.world_blocks.update(key_list)
+    self.block_ids.update(zip(key_list, ids.tolist()))
+    # Group the keys by sector, see `sectorize()`.
+    sx = positions[:, 0] // SECTOR_SIZE
+    sz = positions[:, 2] // SECTOR_SIZE
+    order = np.lexsort((sz, sx))
+    starts = np.flatnonzero(np.diff(sx[order]) | np.diff(sz[order])) + 1
+    for group in np.split(order, starts):
+      if len(group):
+        sector = (int(sx[group[0]]), 0, int(sz[group[0]]))
+        self.sectors.setdefault(sector, set()).update(keys[group].tolist())
+
+  def __contains__(self, position):
+    return pack(position) in self.world_blocks
+
+  def block_id(self, position):
+    return self.block_ids.get(pack(position))
+
+  def texture(self, position):
+    block_id = self.block_id(position)
+    return None if block_id is None else self.types.textures[block_id]
+
+  def ray_trace(self, position, vector, max_distance=8):
+    blocks = self.world_blocks
+    return raycast(lambda pos: pack(pos) in blocks, position, vector,
+                   max_distance)
+
+  def exposed(self, key):
+    """ Returns whether any face of the block at `key` is not covered by
+    another block, or is seen through a transparent block of another type.
+
+    """
+    ids = self.block_ids
+    block_id = ids[key]
+    transparent = self.types.transparent
+    for step in FACE_STEPS:
+      other = ids.get(key + step)
+      if other is None or (transparent[other] and other != block_id):
+        return True
+    return False
+
+  def add_block(self, position, block_id, immediate=True):
+    """ Add a block of type `block_id`, see `BlockTypes`, at `position`. With
+    `immediate` False, it is not drawn until its sector is shown again.
+
+    """
+    key = pack(position)
+    if key in self.world_blocks:
+      self.remove_block(position, immediate)
+    self.world_blocks.add(key)
+    self.block_ids[key] = block_id
+    self.sectors.setdefault(sectorize(position), set()).add(key)
+    if immediate:
+      if self.exposed(key):
+        self.show_block(key)
+      self.check_neighbors(key)
+
+  def remove_block(self, position, immediate=True):
+    key = pack(position)
+    self.world_blocks.remove(key)
+    del self.block_ids[key]
+    self.sectors[sectorize(position)].discard(key)
+    if immediate:
+      if key in self.shown:
+        self.hide_block(key)
+      self.check_neighbors(key)
+
+  def check_neighbors(self, key):
+    """ Show the neighbours of the block at `key` that became exposed and
+    hide those that became covered.
+
+    """
+    for step in FACE_STEPS:
+      other = key + step
+      if other not in self.world_blocks:
+        continue
+      if self.exposed(other):
+        if other not in self.shown:
+          self.show_block(other)
+      elif other in self.shown:
+        self.hide_block(other)
+
+  def show_block(self, key, immediate=True):
+    block_id = self.block_ids[key]
+    self.shown[key] = block_id
+    if immediate:
+      self._show_block(key, block_id)
+    else:
+      self.queue.append((self._show_block, (key, block_id)))
+
+  def _show_block(self, key, block_id):
+    # The block may have been hidden or drawn since this was queued.
+    if key not in self.shown or key in self.block_to_vList:
+      return
+    self.block_to_vList[key] = self.batch.add(24, GL_QUADS, self.group,
+                                              ('v3f/static', vertices(unpack(key))),
+                                              ('t2f/static', self.types.textures[block_id]))
+
+  def hide_block(self, key, immediate=True):
+    self.shown.pop(key)
+    if immediate:
+      self._hide_block(key)
+    else:
+      self.queue.append((self._hide_block, (key,)))
+
+  def _hide_block(self, key):
+    if key in self.shown or key not in self.block_to_vList:
+      return
+    self.block_to_vList.pop(key).delete()
+
+  def show_sector(self, sector):
+    for key in self.sectors.get(sector, ()):
+      if key not in self.shown and self.exposed(key):
+        self.show_block(key, False)
+
+  def hide_sector(self, sector):
+    for key in self.sectors.get(sector, ()):
+      if key in self.shown:
+        self.hide_block(key, False)
+
+  def change_sectors(self, before, after, pad=4):
+    """ Move from sector `before` to sector `after`, queuing the sectors
+    within `pad` sectors of the player to be shown and the others hidden.
+
+    """
+    before_set = set()
+    after_set = set()
+    for dx in range(-pad, pad + 1):
+      for dz in range(-pad, pad + 1):
+        if dx ** 2 + dz ** 2 > (pad + 1) ** 2:
+          continue
+        if before:
+          x, y, z = before
+          before_set.add((x + dx, y, z + dz))
+        if after:
+          x, y, z = after
+          after_set.add((x + dx, y, z + dz))
+    for sector in after_set - before_set:
+      self.show_sector(sector)
+    for sector in before_set - after_set:
+      self.hide_sector(sector)
+
+  def process_queue(self, budget=1.0 / 60):
+    """ Work through the queue for at most `budget` seconds.
+
+    """
+    start = time.perf_counter()
+    while self.queue and time.perf_counter() - start < budget:
+      func, args = self.queue.popleft()
+      func(*args)
+
+  def process_entire_queue(self):
+    while self.queue:
+      func, args = self.queue.popleft()
+      func(*args)
+
+  def add_falling(self, position, block_id, velocity=0):
+    block = Block(position, block_id)
+    block.is_moving = True
+    block.velocity = velocity
+    block.vList = self.batch.add(24, GL_QUADS, self.group,
+                                 ('v3f/stream', block.getVertices()),
+                                 ('t2f/static', self.types.textures[block_id]))
+    self.on_air.add(block)
+    return block
+
+  def move_falling(self, block, position):
+    block.setPosition(position)
+    block.vList.vertices[:] = block.getVertices()
+
+  def remove_falling(self, block):
+    self.on_air.remove(block)
+    block.vList.delete()
+    block.vList = None
@@ -0,0 +1,298 @@
+""" Benchmarks for world generation, sector streaming, ray casts, collisions,
+block edits and saving.
+
+Every benchmark starts from the same seed, so runs on the same machine are
+comparable. Results are printed and written as JSON:
+
+    $ python benchmark.py --output bench.json
+
+Sector streaming is measured on the mesher alone by default. Pass `--gl` to
+also time `Renderer.process_entire_queue()` and a sector crossing including
+the upload to OpenGL; this opens a hidden window.
+
+"""
+from __future__ import division
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from Collision import sweep
+from Mesher import SectorMesher
+from Model import HILLS, WORLD_SIZE, Model, nearby_levels
+from Simulation import PLAYER_BOX, TICKS_PER_SEC, Simulation
+
+SEED = 1234
+
+# Number of rays of the small batch timed by `bench_raycast()`.
+SMALL_BATCH = 1000
+
+
+def timed(func, *args):
+    """ Returns the result of calling `func` and the seconds it took.
+
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def rate(func, count):
+    """ Call `func(i)` for i in range(count) and return the calls per second.
+
+    """
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return count / (time.perf_counter() - start)
+
+
+def bench_world(args, results):
+    random.seed(SEED)
+    tracemalloc.start()
+    model, seconds = timed(Model, args.world_size, args.hills)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['world_init'] = (seconds, 's')
+    results['world_blocks'] = (len(model.world), 'blocks')
+    results['world_init_peak_memory'] = (peak / 2 ** 20, 'MiB')
+    results['world_memory'] = (current / 2 ** 20, 'MiB')
+    return model
+
+
+def bench_meshing(args, results, model):
+    mesher = SectorMesher(model.world)
+    shown = nearby_levels((0, 0, 0))
+    _, seconds = timed(lambda: [mesher.mesh(s, l) for s, l in shown.items()])
+    results['mesh_initial_sectors'] = (seconds, 's')
+    # Walk one sector along x: only the sectors newly visible or changing
+    # their level of detail are built.
+    show = [(s, l) for s, l in nearby_levels((1, 0, 0)).items()
+            if shown.get(s) != l]
+    _, seconds = timed(lambda: [mesher.mesh(s, l) for s, l in show])
+    results['mesh_sector_crossing'] = (seconds, 's')
+    quads = sum(len(v) // 12 for s, l in shown.items()
+                for v, t in mesher.mesh(s, l).values())
+    results['mesh_initial_quads'] = (quads, 'quads')
+
+
+def bench_occlusion(args, results, model):
+    shown = nearby_levels((0, 0, 0))
+    # The first walk finds the face links of every sector on the way.
+    _, seconds = timed(model.graph.reachable, (0, 0, 0), shown)
+    results['occlusion_graph'] = (seconds, 's')
+    reachable, seconds = timed(model.graph.reachable, (0, 0, 0), shown)
+    results['occlusion_walk'] = (seconds, 's')
+    results['occlusion_reachable'] = (len(reachable) / len(shown), 'of shown')
+
+
+def bench_gl(args, results, model):
+    import pyglet
+    from main import Renderer
+    window = pyglet.window.Window(visible=False)
+    try:
+        renderer = Renderer(model)
+        renderer.change_sectors(None, (0, 0, 0))
+        _, seconds = timed(renderer.process_entire_queue)
+        results['process_entire_queue'] = (seconds, 's')
+        renderer.change_sectors((0, 0, 0), (1, 0, 0))
+        _, seconds = timed(renderer.process_entire_queue)
+        results['sector_crossing'] = (seconds, 's')
+    finally:
+        window.close()
+
+
+def bench_raycast(args, results, model):
+    rng = np.random.RandomState(SEED)
+    n = args.rays
+    positions = rng.uniform(-args.world_size + 2, args.world_size - 2, (n, 3))
+    positions[:, 1] = rng.uniform(-1, 4, n)
+    vectors = rng.normal(size=(n, 3))
+    vectors /= np.sqrt((vectors ** 2).sum(axis=1))[:, None]
+    points = [tuple(p) for p in positions.tolist()]
+    rays = [tuple(v) for v in vectors.tolist()]
+    results['raycasts_per_sec'] = (
+        rate(lambda i: model.hit_test(points[i], rays[i]), n), 'rays/s')
+    _, seconds = timed(model.hit_test_many, positions, vectors)
+    results['batched_raycasts_per_sec'] = (n / seconds, 'rays/s')
+    # The rays of a single tick are far fewer, so the fixed cost of a batch
+    # matters as much as its rate.
+    small = min(n, SMALL_BATCH)
+    _, seconds = timed(model.hit_test_many, positions[:small],
+                       vectors[:small])
+    results['batched_raycasts_%d_per_sec' % small] = (small / seconds,
+                                                      'rays/s')
+
+
+def bench_collision(args, results, model):
+    rng = np.random.RandomState(SEED)
+    n = args.steps
+    positions = rng.uniform(-args.world_size + 2, args.world_size - 2, (n, 3))
+    positions[:, 1] = 0.0
+    deltas = rng.uniform(-0.5, 0.5, (n, 3))
+    points = [tuple(p) for p in positions.tolist()]
+    moves = [tuple(d) for d in deltas.tolist()]
+    results['collision_sweeps_per_sec'] = (rate(
+        lambda i: sweep(model.world, points[i], moves[i], PLAYER_BOX), n),
+        'sweeps/s')
+    simulation = Simulation(model)
+    simulation.strafe = [-1, 0]
+    results['simulation_ticks_per_sec'] = (rate(
+        lambda i: simulation.step(1.0 / TICKS_PER_SEC), n), 'ticks/s')
+
+
+def bench_edits(args, results, model):
+    rng = random.Random(SEED)
+    n = args.edits
+    o = args.world_size - 2
+    positions = list(set(
+        (rng.randint(-o, o), rng.randint(6, 20), rng.randint(-o, o))
+        for _ in range(n)))
+    brick = model.world.types.named('brick')
+    results['block_adds_per_sec'] = (rate(
+        lambda i: model.add_block(positions[i], brick), len(positions)),
+        'blocks/s')
+    results['block_removes_per_sec'] = (rate(
+        lambda i: model.remove_block(positions[i]), len(positions)),
+        'blocks/s')
+    # Scripted edits of a 32 x 32 x 32 box, including remeshing every
+    # sector they touch once.
+    mesher = SectorMesher(model.world)
+    for name, edit in [
+            ('fill_box_32', lambda: model.fill_box((0, 0, 0), (32, 32, 32),
+                                                   brick)),
+            ('clear_box_32', lambda: model.clear_box((0, 0, 0), (32, 32, 32)))]:
+        model.dirty.clear()
+        _, seconds = timed(lambda: [edit(), [mesher.mesh(s)
+                                             for s in model.dirty]])
+        results[name] = (seconds, 's')
+
+
+def bench_streaming(args, results):
+    """ Walk across an endless world, loading the columns in view and
+    evicting those left behind as `Window.update()` does.
+
+    """
+    model = Model(world_size=None, seed=SEED)
+    columns = set((x, 0, z) for x, _, z in nearby_levels((0, 0, 0)))
+    loaded = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for step in range(args.walk):
+        for x, _, z in columns:
+            if (x + step, 0, z) not in model.world.chunks:
+                loaded += 1
+                model.world.chunk((x + step, 0, z))
+        model.evict((step, 0, 0))
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['stream_columns_per_sec'] = (loaded / seconds, 'columns/s')
+    results['stream_columns_in_memory'] = (len(model.world.chunks), 'columns')
+    results['stream_peak_memory'] = (peak / 2 ** 20, 'MiB')
+
+
+def bench_saving(args, results):
+    """ Save edits reaching far above and below the terrain to region files
+    and load them back, checking that every block survives the round trip.
+
+    """
+    path = tempfile.mkdtemp()
+    try:
+        model = Model(world_size=None, path=path, seed=SEED)
+        # A tower from below the lowest to above the highest height region
+        # files store by default, which makes them grow.
+        brick = model.world.types.named('brick')
+        edits = [((0, -80, 0), (2, 200, 2), brick), ((40, 90, 40),
+                                                     (41, 130, 41), brick)]
+        for lo, hi, block_id in edits:
+            model.fill_box(lo, hi, block_id)
+        _, seconds = timed(model.save)
+        results['save_tower'] = (seconds, 's')
+        expected = [model.world.region(lo, hi) for lo, hi, _ in edits]
+        model.storage.close()
+
+        model = Model(world_size=None, path=path, seed=SEED)
+        for (lo, hi, _), ids in zip(edits, expected):
+            if not np.array_equal(model.world.region(lo, hi), ids):
+                raise AssertionError('blocks %s to %s changed when saved' %
+                                     (lo, hi))
+        model.storage.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def peak_rss():
+    """ Returns the peak resident set size of the process in MiB, or None
+    where it cannot be queried.
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--world-size', type=int, default=WORLD_SIZE,
+                        help='1/2 width and height of the world')
+    parser.add_argument('--hills', type=int, default=HILLS,
+                        help='number of hills to generate')
+    parser.add_argument('--rays', type=int, default=20000,
+                        help='number of ray casts')
+    parser.add_argument('--steps', type=int, default=20000,
+                        help='number of collision sweeps and ticks')
+    parser.add_argument('--edits', type=int, default=5000,
+                        help='number of blocks to add and remove')
+    parser.add_argument('--walk', type=int, default=100,
+                        help='sectors walked across the endless world')
+    parser.add_argument('--gl', action='store_true',
+                        help='also time uploads to OpenGL')
+    args = parser.parse_args()
+
+    results = {}
+    model = bench_world(args, results)
+    bench_meshing(args, results, model)
+    bench_occlusion(args, results, model)
+    if args.gl:
+        bench_gl(args, results, model)
+    bench_raycast(args, results, model)
+    bench_collision(args, results, model)
+    bench_edits(args, results, model)
+    bench_streaming(args, results)
+    bench_saving(args, results)
+    results['peak_rss'] = (peak_rss(), 'MiB')
+
+    for name, (value, unit) in results.items():
+        if value is None:
+            continue
+        print('%-28s %14.4f %s' % (name, value, unit))
+    if args.output:
+        report = {
+            'seed': SEED,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': dict((name, {'value': value, 'unit': unit})
+                            for name, (value, unit) in results.items()),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
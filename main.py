@@ -1,11 +1,23 @@
 from __future__ import division
 
+import argparse
+import multiprocessing
 import sys
 import math
-import random
 import time
 
-from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import numpy as np
+import pyglet
+
+# The mesh workers, see `Renderer`, import this module again where processes
+# are spawned rather than forked, e.g. on macOS and Windows. They only run
+# `Mesher.build_mesh()`, so keep pyglet from creating the shadow window and
+# its GL context when they import pyglet.gl below.
+if multiprocessing.current_process().name != 'MainProcess':
+    pyglet.options['shadow_window'] = False
+
 from pyglet import image
 from pyglet.gl import *
 from pyglet.graphics import TextureGroup
@@ -14,484 +26,470 @@ from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 
-TICKS_PER_SEC = 60
-
-# Size of sectors used to ease block loading.
-SECTOR_SIZE = 16
-
-WALKING_SPEED = 5
-FLYING_SPEED = 15
-
-GRAVITY = 20.0
-MAX_JUMP_HEIGHT = 1.0  # About the height of a block.
-
-JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
-TERMINAL_VELOCITY = 50
-
-PLAYER_HEIGHT = 2
+import Frustum
+from Mesher import SectorMesher, build_mesh
+from Model import WORLD_SIZE, Model, nearby_levels, sectorize
+from Profiler import PROFILER
+from Replay import Recorder, apply
+from Simulation import TICKS_PER_SEC, Simulation
 
 if sys.version_info[0] >= 3:
     xrange = range
 
 
-def cube_vertices(x, y, z, n):
-    """ Return the vertices of the cube at position x, y, z with size 2*n.
-
-    """
-    return [
-        x-n, y+n, z-n, x-n, y+n, z+n, x+n, y+n, z+n, x+n, y+n, z-n,  # top
-        x-n, y-n, z-n, x+n, y-n, z-n, x+n, y-n, z+n, x-n, y-n, z+n,  # bottom
-        x-n, y-n, z-n, x-n, y-n, z+n, x-n, y+n, z+n, x-n, y+n, z-n,  # left
-        x+n, y-n, z+n, x+n, y-n, z-n, x+n, y+n, z-n, x+n, y+n, z+n,  # right
-        x-n, y-n, z+n, x+n, y-n, z+n, x+n, y+n, z+n, x-n, y+n, z+n,  # front
-        x+n, y-n, z-n, x-n, y-n, z-n, x-n, y+n, z-n, x+n, y+n, z-n,  # back
-    ]
-
-
-def tex_coord(x, y, n=4):
-    """ Return the bounding vertices of the texture square.
-
-    """
-    m = 1.0 / n
-    dx = x * m
-    dy = y * m
-    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
-
-
-def tex_coords(top, bottom, side):
-    """ Return a list of the texture squares for the top, bottom and side.
-
-    """
-    top = tex_coord(*top)
-    bottom = tex_coord(*bottom)
-    side = tex_coord(*side)
-    result = []
-    result.extend(top)
-    result.extend(bottom)
-    result.extend(side * 4)
-    return result
-
-
 TEXTURE_PATH = 'texture1.png'
 
-GRASS = tex_coords((1, 0), (0, 1), (0, 0))
-SAND = tex_coords((1, 1), (1, 1), (1, 1))
-BRICK = tex_coords((2, 0), (2, 0), (2, 0))
-STONE = tex_coords((2, 1), (2, 1), (2, 1))
+# Number of tiles along each side of the texture atlas.
+TEXTURE_TILES = 4
 
-FACES = [
-    (0, 1, 0),
-    (0, -1, 0),
-    (-1, 0, 0),
-    (1, 0, 0),
-    (0, 0, 1),
-    (0, 0, -1),
-]
+# Bounds of the time per tick spent on showing and hiding sectors. The
+# budget shrinks when ticks run late and grows back while they are on time.
+MIN_QUEUE_BUDGET = 0.002
+MAX_QUEUE_BUDGET = 0.5 / TICKS_PER_SEC
 
 
-def normalize(position):
-    """ Accepts `position` of arbitrary precision and returns the block
-    containing that position.
+class Renderer(object):
+    """ Draws the blocks of a `Model` as one merged mesh per shown sector.
 
-    Parameters
-    ----------
-    position : tuple of len 3
+    Vertices are stored as shorts relative to their sector and texture
+    coordinates as shorts counting blocks, half the bytes of floats. pyglet
+    interleaves the static attributes of a vertex list into one buffer.
 
-    Returns
-    -------
-    block_position : tuple of ints of len 3
+    Meshes of newly shown sectors are built by worker processes from
+    snapshots of the sector's blocks; only the upload of the finished mesh
+    happens on the GL thread. A sector keeps drawing its old mesh until the
+    new one is uploaded, then the two are swapped in one step.
 
     """
-    x, y, z = position
-    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
-    return (x, y, z)
 
+    def __init__(self, model, executor=None):
 
-def sectorize(position):
-    """ Returns a tuple representing the sector for the given `position`.
+        # The model to draw.
+        self.model = model
 
-    Parameters
-    ----------
-    position : tuple of len 3
+        # Mapping from sector to the Batch drawing its mesh. A Batch is a
+        # collection of vertex lists for batched rendering; one per sector
+        # lets `draw()` skip the sectors outside the view.
+        self.batches = {}
 
-    Returns
-    -------
-    sector : tuple of len 3
+        # The texture atlas and a mapping from atlas tile to the TextureGroup
+        # drawing it, see `_tile_group()`.
+        self.atlas = image.load(TEXTURE_PATH)
+        self.groups = {}
 
-    """
-    x, y, z = normalize(position)
-    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
-    return (x, 0, z)
+        # A TextureGroup manages an OpenGL texture. This one draws single
+        # blocks straight from the atlas.
+        self.group = TextureGroup(self.atlas.get_texture())
 
+        # Builds the merged geometry of a sector.
+        self.mesher = SectorMesher(model.world, TEXTURE_TILES)
 
-    
-class Model(object):
-
-    def __init__(self):
-
-        # A Batch is a collection of vertex lists for batched rendering.
-        self.batch = pyglet.graphics.Batch()
-
-        # A TextureGroup manages an OpenGL texture.
-        self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
-
-        # A mapping from position to the texture of the block at that position.
-        # This defines all the blocks that are currently in the world.
-        self.world = {}
-
-        # Same mapping as `world` but only contains blocks that are shown.
+        # Mapping from shown sector to the level of detail it is drawn at,
+        # see `Mesher.build_mesh()`.
         self.shown = {}
 
-        # Mapping from position to a pyglet `VertextList` for all shown blocks.
+        # Mapping from sector to the pyglet `VertexList`s of its mesh, one per
+        # texture tile.
         self._shown = {}
 
-        # Mapping from sector to a list of positions inside that sector.
-        self.sectors = {}
-
-        # Simple function queue implementation. The queue is populated with
-        # _show_block() and _hide_block() calls
-        self.queue = deque()
-
-        self._initialize()
-
-    def _initialize(self):
-        """ Initialize the world by placing all the blocks.
-
-        """
-        n = 80  # 1/2 width and height of world
-        s = 1  # step size
-        y = 0  # initial y height
-        for x in xrange(-n, n + 1, s):
-            for z in xrange(-n, n + 1, s):
-                # create a layer stone an grass everywhere.
-                self.add_block((x, y - 2, z), GRASS, immediate=False)
-                self.add_block((x, y - 3, z), STONE, immediate=False)
-                if x in (-n, n) or z in (-n, n):
-                    # create outer walls.
-                    for dy in xrange(-2, 3):
-                        self.add_block((x, y + dy, z), STONE, immediate=False)
-
-        # generate the hills randomly
-        o = n - 10
-        for _ in xrange(120):
-            a = random.randint(-o, o)  # x position of the hill
-            b = random.randint(-o, o)  # z position of the hill
-            c = -1  # base of the hill
-            h = random.randint(1, 6)  # height of the hill
-            s = random.randint(4, 8)  # 2 * s is the side length of the hill
-            d = 1  # how quickly to taper off the hills
-            t = random.choice([GRASS, SAND, BRICK])
-            for y in xrange(c, c + h):
-                for x in xrange(a - s, a + s + 1):
-                    for z in xrange(b - s, b + s + 1):
-                        if (x - a) ** 2 + (z - b) ** 2 > (s + 1) ** 2:  # kind of circular shape
-                            continue
-                        if (x - 0) ** 2 + (z - 0) ** 2 < 5 ** 2:  # cannot be close to the corner
-                            continue
-                        self.add_block((x, y, z), t, immediate=False)
-                s -= d  # decrement side length so hills taper off
-
-    def hit_test(self, position, vector, max_distance=8):
-        """ Line of sight search from current position. If a block is
-        intersected it is returned, along with the block previously in the line
-        of sight. If no block is found, return None, None.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position to check visibility from.
-        vector : tuple of len 3
-            The line of sight vector.
-        max_distance : int
-            How many blocks away to search for a hit.
-
-        """
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in xrange(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, previous
-
-    def exposed(self, position):
-        """ Returns False is given `position` is surrounded on all 6 sides by
-        blocks, True otherwise.
-
-        """
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            if (x + dx, y + dy, z + dz) not in self.world:
-                return True
-        return False
-
-    def add_block(self, position, texture, immediate=True):
-        """ Add a block with the given `texture` and `position` to the world.
+        # Mapping from sector to the level of detail of its uploaded or
+        # pending mesh.
+        self._levels = {}
 
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to add.
-        texture : list of len 3
-            The coordinates of the texture squares. Use `tex_coords()` to
-            generate.
-        immediate : bool
-            Whether or not to draw the block immediately.
+        # Mapping from sector to the work queued for it: True to show it,
+        # False to hide it. Queuing work for a sector replaces or cancels
+        # the work already queued for it, so no stale work is ever done.
+        self.queue = {}
 
-        """
-        if position in self.world:
-            self.remove_block(position, immediate)
-        self.world[position] = texture
-        self.sectors.setdefault(sectorize(position), []).append(position)
-        if immediate:
-            if self.exposed(position):
-                self.show_block(position)
-            self.check_neighbors(position)
+        # Seconds per tick `process_queue()` may spend, see `_adapt()`.
+        self.budget = MAX_QUEUE_BUDGET / 2
 
-    def remove_block(self, position, immediate=True):
-        """ Remove the block at the given `position`.
+        # Runs `build_mesh()` off the GL thread. Only functions of GL-free
+        # modules such as `Mesher` may be submitted to it.
+        self.executor = executor or ProcessPoolExecutor()
 
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to remove.
-        immediate : bool
-            Whether or not to immediately remove block from canvas.
+        # Mapping from sector to the future of the mesh being built for it.
+        # A future replaced or removed here is stale and its mesh dropped.
+        self._pending = {}
 
-        """
-        del self.world[position]
-        self.sectors[sectorize(position)].remove(position)
-        if immediate:
-            if position in self.shown:
-                self.hide_block(position)
-            self.check_neighbors(position)
+        # The camera sector and graph version the sectors in `_reachable`
+        # were found for, see `draw()`.
+        self._reachable_key = None
+        self._reachable = set()
 
-    def check_neighbors(self, position):
-        """ Check all blocks surrounding `position` and ensure their visual
-        state is current. This means hiding blocks that are not exposed and
-        ensuring that all exposed blocks are shown. Usually used after a block
-        is added or removed.
-
-        """
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            key = (x + dx, y + dy, z + dz)
-            if key not in self.world:
-                continue
-            if self.exposed(key):
-                if key not in self.shown:
-                    self.show_block(key)
-            else:
-                if key in self.shown:
-                    self.hide_block(key)
-
-    def show_block(self, position, immediate=True):
-        """ Show the block at the given `position`. This method assumes the
-        block has already been added with add_block()
+    def show_sector(self, sector, immediate=True, level=0):
+        """ Ensure the geometry of the given sector is drawn to the canvas.
 
         Parameters
         ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to show.
+        sector : tuple of len 3
+            The sector to show.
         immediate : bool
-            Whether or not to show the block immediately.
+            Whether or not to build the sector mesh immediately.
+        level : int
+            The level of detail to draw the sector at. Level n merges cells
+            of 2 ** n blocks along each axis.
 
         """
-        texture = self.world[position]
-        self.shown[position] = texture
+        self.shown[sector] = level
         if immediate:
-            self._show_block(position, texture)
+            self.queue.pop(sector, None)
+            self._build_sector(sector)
         else:
-            self._enqueue(self._show_block, position, texture)
-
-    def _show_block(self, position, texture):
-        """ Private implementation of the `show_block()` method.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to show.
-        texture : list of len 3
-            The coordinates of the texture squares. Use `tex_coords()` to
-            generate.
-
-        """
-        x, y, z = position
-        vertex_data = cube_vertices(x, y, z, 0.5)
-        texture_data = list(texture)
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._shown[position] = self.batch.add(24, GL_QUADS, self.group,
-                                               ('v3f/static', vertex_data),
-                                               ('t2f/static', texture_data))
-
-    def hide_block(self, position, immediate=True):
-        """ Hide the block at the given `position`. Hiding does not remove the
-        block from the world.
+            self._enqueue(sector, True)
+
+    def _show_sector(self, sector):
+        """ Private implementation of the `show_sector()` method. Hands a
+        snapshot of the sector to a worker; the mesh is uploaded by
+        `process_results()` once it is done.
+
+        """
+        self.model.dirty.discard(sector)
+        self._cancel(sector)
+        level = self._levels[sector] = self.shown.get(sector, 0)
+        snapshot = self.mesher.snapshot(sector, level)
+        if not snapshot[1].size:
+            # Nothing exposed in the sector, no need to bother a worker.
+            self._upload(sector, {})
+            return
+        self._pending[sector] = self.executor.submit(build_mesh, *snapshot)
+
+    def _build_sector(self, sector):
+        """ Build and upload the mesh of `sector` right away on this thread.
+
+        """
+        self.model.dirty.discard(sector)
+        self._cancel(sector)
+        level = self._levels[sector] = self.shown.get(sector, 0)
+        self._upload(sector, self.mesher.mesh(sector, level))
+
+    def _cancel(self, sector):
+        """ Drop the mesh being built for `sector`, if any.
+
+        """
+        future = self._pending.pop(sector, None)
+        if future is not None:
+            future.cancel()
+
+    def _upload(self, sector, mesh):
+        """ Upload `mesh`, see `build_mesh()`, as the geometry of `sector`,
+        replacing the previous mesh only once the new one is in place.
+
+        """
+        batch = pyglet.graphics.Batch()
+        vertex_lists = []
+        for tile, (vertex_data, texture_data) in mesh.items():
+            vertex_lists.append(batch.add(
+                len(vertex_data) // 3, GL_QUADS, self._tile_group(tile),
+                ('v3s/static', vertex_data),
+                ('t2s/static', texture_data)))
+            # Both arrays are uploaded as GLshorts.
+            PROFILER.count('upload bytes',
+                           2 * (len(vertex_data) + len(texture_data)))
+        PROFILER.count('uploads')
+        self._delete_sector(sector)
+        self._shown[sector] = vertex_lists
+        if vertex_lists:
+            self.batches[sector] = batch
+
+    def hide_sector(self, sector, immediate=True):
+        """ Ensure the geometry of the given sector is removed from the
+        canvas. Hiding does not remove any blocks from the world.
 
         Parameters
         ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to hide.
+        sector : tuple of len 3
+            The sector to hide.
         immediate : bool
-            Whether or not to immediately remove the block from the canvas.
+            Whether or not to immediately remove the sector from the canvas.
 
         """
-        self.shown.pop(position)
+        self.shown.pop(sector, None)
         if immediate:
-            self._hide_block(position)
+            self.queue.pop(sector, None)
+            self._hide_sector(sector)
         else:
-            self._enqueue(self._hide_block, position)
+            self._enqueue(sector, False)
 
-    def _hide_block(self, position):
-        """ Private implementation of the 'hide_block()` method.
+    def _hide_sector(self, sector):
+        """ Private implementation of the 'hide_sector()` method.
 
         """
-        self._shown.pop(position).delete()
+        self._cancel(sector)
+        self._delete_sector(sector)
+        self._levels.pop(sector, None)
 
-    def show_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be shown are
-        drawn to the canvas.
+    def _delete_sector(self, sector):
+        self.batches.pop(sector, None)
+        for vertex_list in self._shown.pop(sector, []):
+            vertex_list.delete()
 
-        """
-        for position in self.sectors.get(sector, []):
-            if position not in self.shown and self.exposed(position):
-                self.show_block(position, False)
-
-    def hide_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be hidden are
-        removed from the canvas.
+    def draw(self, planes=None, camera=None):
+        """ Draw the shown sectors whose bounding box intersects the view
+        frustum given by `planes`, see `Frustum.planes()`, and that are not
+        hidden behind terrain from the sector `camera`, see
+        `Occlusion.SectorGraph`. Either test is skipped if None. Sector
+        meshes are stored relative to their sector, so each is translated
+        into place as it is drawn.
 
-        """
-        for position in self.sectors.get(sector, []):
-            if position in self.shown:
-                self.hide_block(position, False)
+        Returns
+        -------
+        count : int
+            The number of sectors drawn.
+
+        """
+        sectors = list(self.batches)
+        if camera is not None:
+            reachable = self.reachable(camera)
+            sectors = [s for s in sectors if s in reachable]
+        size = self.model.world.size
+        if planes is not None and sectors:
+            lo = np.array(sectors) * size - 0.5
+            visible = Frustum.visible(planes, lo, lo + size)
+            sectors = [s for s, v in zip(sectors, visible) if v]
+        for sector in sectors:
+            x, y, z = sector
+            glPushMatrix()
+            glTranslatef(x * size - 0.5, y * size - 0.5, z * size - 0.5)
+            self.batches[sector].draw()
+            glPopMatrix()
+        return len(sectors)
+
+    def reachable(self, camera):
+        """ Returns the set of shown sectors that may be seen from the sector
+        `camera`. Walking the graph is left out until the camera changes
+        sector or the world is edited.
+
+        """
+        graph = self.model.graph
+        key = (camera, graph.version)
+        if key != self._reachable_key:
+            self._reachable = graph.reachable(camera, self.shown)
+            self._reachable_key = key
+        return self._reachable
+
+    def _tile_group(self, tile):
+        """ Returns the `TextureGroup` drawing the texture atlas tile `tile`.
+        Each tile gets its own repeating texture so merged quads can span
+        several blocks.
+
+        """
+        group = self.groups.get(tile)
+        if group is None:
+            x, y = tile
+            size = self.atlas.width // TEXTURE_TILES
+            texture = self.atlas.get_region(
+                x * size, y * size, size, size).get_texture()
+            glBindTexture(texture.target, texture.id)
+            glTexParameteri(texture.target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+            glTexParameteri(texture.target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+            glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            group = self.groups[tile] = TextureGroup(texture)
+        return group
 
     def change_sectors(self, before, after):
         """ Move from sector `before` to sector `after`. A sector is a
-        contiguous x, y sub-region of world. Sectors are used to speed up
-        world rendering.
+        contiguous x, y, z sub-region of world. Sectors are used to speed up
+        world rendering, and are streamed in and out vertically as well as
+        horizontally. Sectors further away are drawn at coarser levels of
+        detail and switch level as the player moves.
 
         """
-        before_set = set()
-        after_set = set()
-        pad = 4
-        for dx in xrange(-pad, pad + 1):
-            for dy in [0]:  # xrange(-pad, pad + 1):
-                for dz in xrange(-pad, pad + 1):
-                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
-                        continue
-                    if before:
-                        x, y, z = before
-                        before_set.add((x + dx, y + dy, z + dz))
-                    if after:
-                        x, y, z = after
-                        after_set.add((x + dx, y + dy, z + dz))
-        show = after_set - before_set
-        hide = before_set - after_set
-        for sector in show:
-            self.show_sector(sector)
-        for sector in hide:
-            self.hide_sector(sector)
+        before_levels = nearby_levels(before) if before else {}
+        after_levels = nearby_levels(after) if after else {}
+        for sector, level in after_levels.items():
+            if before_levels.get(sector) != level:
+                self.show_sector(sector, False, level)
+        for sector in before_levels:
+            if sector not in after_levels:
+                self.hide_sector(sector, False)
+        self._reachable_key = None
 
-    def _enqueue(self, func, *args):
-        """ Add `func` to the internal queue.
+    def _enqueue(self, sector, show):
+        """ Queue showing (`show` True) or hiding `sector`. Work that would
+        undo the work queued for the sector cancels it instead.
 
         """
-        self.queue.append((func, args))
+        if show:
+            done = self._levels.get(sector) == self.shown.get(sector)
+        else:
+            done = sector not in self._levels
+        if done:
+            self.queue.pop(sector, None)
+        else:
+            self.queue[sector] = show
 
-    def _dequeue(self):
-        """ Pop the top function from the internal queue and call it.
+    def _dequeue(self, sector):
+        """ Remove the work queued for `sector` and do it.
 
         """
-        func, args = self.queue.popleft()
-        func(*args)
+        if self.queue.pop(sector):
+            self._show_sector(sector)
+        else:
+            self._hide_sector(sector)
+
+    def _ordered(self, position=None, vector=None):
+        """ Returns the sectors with queued work in the order to process
+        them: hides first, as they are cheap and free memory, then shows
+        nearest to `position` first, sectors in front along `vector` counting
+        as up to twice as near as those behind.
+
+        """
+        hide = [sector for sector, show in self.queue.items() if not show]
+        show = [sector for sector, show in self.queue.items() if show]
+        if position is not None and len(show) > 1:
+            size = self.model.world.size
+            offsets = np.array(show) * size + (size - 1) / 2.0 - position
+            distances = np.sqrt((offsets ** 2).sum(axis=1))
+            if vector is not None:
+                facing = offsets.dot(vector) / np.maximum(distances, 1e-6)
+                distances *= 1.5 - 0.5 * facing
+            show = [show[i] for i in np.argsort(distances, kind='stable')]
+        return hide + show
+
+    def _adapt(self, dt):
+        """ Adapt the budget of `process_queue()` to the measured tick time
+        `dt`: halve it when the tick ran late, grow it slowly otherwise.
+
+        """
+        if dt > 1.25 / TICKS_PER_SEC:
+            self.budget = max(MIN_QUEUE_BUDGET, self.budget / 2)
+        else:
+            self.budget = min(MAX_QUEUE_BUDGET,
+                              self.budget + MIN_QUEUE_BUDGET / 4)
 
-    def process_queue(self):
-        """ Process the entire queue while taking periodic breaks. This allows
-        the game loop to run smoothly. The queue contains calls to
-        _show_block() and _hide_block() so this method should be called if
-        add_block() or remove_block() was called with immediate=False
+    def process_queue(self, position=None, vector=None, dt=None):
+        """ Process the queue while taking periodic breaks. This allows the
+        game loop to run smoothly. The queue contains sectors to show and
+        hide so this method should be called after change_sectors(). Shown
+        sectors that were edited since the last call are rebuilt first.
+
+        Parameters
+        ----------
+        position : tuple of len 3, optional
+            The position of the player. Nearby sectors are shown first.
+        vector : tuple of len 3, optional
+            The line of sight of the player. Sectors in view are shown first.
+        dt : float, optional
+            The duration of the last tick, used to adapt the time spent.
 
         """
         start = time.perf_counter()
-        while self.queue and time.perf_counter() - start < 1.0 / TICKS_PER_SEC:
-            self._dequeue()
+        if dt is not None:
+            self._adapt(dt)
+        deadline = start + self.budget
+        self.process_dirty()
+        if self.queue:
+            for sector in self._ordered(position, vector):
+                if time.perf_counter() >= deadline:
+                    break
+                self._dequeue(sector)
+        self.process_results(deadline)
 
     def process_entire_queue(self):
-        """ Process the entire queue with no breaks.
+        """ Process the entire queue with no breaks, waiting for all meshes
+        to be built and uploaded.
 
         """
-        while self.queue:
-            self._dequeue()
+        self.process_dirty()
+        for sector in self._ordered():
+            self._dequeue(sector)
+        wait(list(self._pending.values()))
+        self.process_results()
+
+    def process_results(self, deadline=None):
+        """ Upload the meshes finished by the workers, stopping at `deadline`
+        (a `time.perf_counter()` value) if given.
+
+        """
+        for sector, future in list(self._pending.items()):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if not future.done():
+                continue
+            del self._pending[sector]
+            if sector in self.shown:
+                self._upload(sector, future.result())
+
+    def process_dirty(self):
+        """ Rebuild the mesh of every shown sector edited since the last call.
+        Each sector is rebuilt once no matter how many of its blocks changed.
+        Edits are few and the player expects to see them on the next frame,
+        so these are built right away rather than by the workers.
+
+        """
+        dirty, self.model.dirty = self.model.dirty, set()
+        for sector in dirty:
+            if sector not in self._levels:
+                continue
+            if sector in self.shown:
+                self._build_sector(sector)
+            else:
+                # Queued to be hidden; do it now rather than keep a stale
+                # mesh that a later show would cancel the hide of.
+                self.queue.pop(sector, None)
+                self._hide_sector(sector)
 
 
 class Window(pyglet.window.Window):
 
     def __init__(self, *args, **kwargs):
+        model = kwargs.pop('model', None)
+        profile = kwargs.pop('profile', None)
+        record = kwargs.pop('record', False)
         super(Window, self).__init__(*args, **kwargs)
 
         # Whether or not the window exclusively captures the mouse.
         self.exclusive = False
 
-        # When flying gravity has no effect and speed is increased.
-        self.flying = False
-
-        # Strafing is moving lateral to the direction you are facing,
-        # e.g. moving to the left or right while continuing to face forward.
-        #
-        # First element is -1 when moving forward, 1 when moving back, and 0
-        # otherwise. The second element is -1 when moving left, 1 when moving
-        # right, and 0 otherwise.
-        self.strafe = [0, 0]
-
-        # Current (x, y, z) position in the world, specified with floats. Note
-        # that, perhaps unlike in math class, the y-axis is the vertical axis.
-        self.position = (0, 0, 0)
-
-        # First element is rotation of the player in the x-z plane (ground
-        # plane) measured from the z-axis down. The second is the rotation
-        # angle from the ground plane up. Rotation is in degrees.
-        #
-        # The vertical plane rotation ranges from -90 (looking straight down) to
-        # 90 (looking straight up). The horizontal rotation range is unbounded.
-        self.rotation = (0, 0)
-
         # Which sector the player is currently in.
         self.sector = None
 
         # The crosshairs at the center of the screen.
         self.reticle = None
 
-        # Velocity in the y (upward) direction.
-        self.dy = 0
-
-        # A list of blocks the player can place. Hit num keys to cycle.
-        self.inventory = [BRICK, GRASS, SAND]
-
-        # The current block the user can place. Hit num keys to cycle.
-        self.block = self.inventory[0]
-
         # Convenience list of num keys.
         self.num_keys = [
             key._1, key._2, key._3, key._4, key._5,
             key._6, key._7, key._8, key._9, key._0]
 
-        # Instance of the model that handles the world.
-        self.model = Model()
+        # The game state: world, player and falling blocks. The window only
+        # renders it and forwards input to it.
+        self.simulation = Simulation(model)
+
+        # Records the input given to the simulation if `record` is set, see
+        # `act()`.
+        self.recorder = Recorder(self.simulation) if record else None
 
-        self.on_air = {}
-        self.block_velocity = {}
+        # Draws the world of the simulation.
+        self.renderer = Renderer(self.simulation.model)
+
+        # The dynamic vertex list the falling blocks are drawn from.
+        self.falling_list = None
+
+        # The clip planes of the current 3D view, see `set_3d()`.
+        self.frustum = None
 
         # The label that is displayed in the top left of the canvas.
         self.label = pyglet.text.Label('', font_name='Arial', font_size=18,
                                        x=10, y=self.height - 10, anchor_x='left', anchor_y='top',
                                        color=(0, 0, 0, 255))
 
+        # Whether the label and the frame profile are shown, toggled with F3.
+        self.hud = False
+
+        # File the frame profile is written to on exit, None for none. The
+        # profiler only runs while it is set or the HUD is shown.
+        self.profile = profile
+        PROFILER.enable(profile is not None)
+
+        # The frame profile shown below the label, see `Profiler.report()`.
+        self.profile_label = pyglet.text.Label(
+            '', font_name='Courier New', font_size=10, x=10,
+            y=self.height - 40, anchor_x='left', anchor_y='top',
+            width=400, multiline=True, color=(0, 0, 0, 255))
+
         # This call schedules the `update()` method to be called
         # TICKS_PER_SEC. This is the main game event loop.
         pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
@@ -504,62 +502,6 @@ class Window(pyglet.window.Window):
         super(Window, self).set_exclusive_mouse(exclusive)
         self.exclusive = exclusive
 
-    def get_sight_vector(self):
-        """ Returns the current line of sight vector indicating the direction
-        the player is looking.
-
-        """
-        x, y = self.rotation
-        # y ranges from -90 to 90, or -pi/2 to pi/2, so m ranges from 0 to 1 and
-        # is 1 when looking ahead parallel to the ground and 0 when looking
-        # straight up or down.
-        m = math.cos(math.radians(y))
-        # dy ranges from -1 to 1 and is -1 when looking straight down and 1 when
-        # looking straight up.
-        dy = math.sin(math.radians(y))
-        dx = math.cos(math.radians(x - 90)) * m
-        dz = math.sin(math.radians(x - 90)) * m
-        return (dx, dy, dz)
-
-    def get_motion_vector(self):
-        """ Returns the current motion vector indicating the velocity of the
-        player.
-
-        Returns
-        -------
-        vector : tuple of len 3
-            Tuple containing the velocity in x, y, and z respectively.
-
-        """
-        if any(self.strafe):
-            x, y = self.rotation
-            strafe = math.degrees(math.atan2(*self.strafe))
-            y_angle = math.radians(y)
-            x_angle = math.radians(x + strafe)
-            if self.flying:
-                m = math.cos(y_angle)
-                dy = math.sin(y_angle)
-                if self.strafe[1]:
-                    # Moving left or right.
-                    dy = 0.0
-                    m = 1
-                if self.strafe[0] > 0:
-                    # Moving backwards.
-                    dy *= -1
-                # When you are flying up or down, you have less left and right
-                # motion.
-                dx = math.cos(x_angle) * m
-                dz = math.sin(x_angle) * m
-            else:
-                dy = 0.0
-                dx = math.cos(x_angle)
-                dz = math.sin(x_angle)
-        else:
-            dy = 0.0
-            dx = 0.0
-            dz = 0.0
-        return (dx, dy, dz)
-
     def update(self, dt):
         """ This method is scheduled to be called repeatedly by the pyglet
         clock.
@@ -570,119 +512,37 @@ class Window(pyglet.window.Window):
             The change in time since the last call.
 
         """
-        self.model.process_queue()
-        sector = sectorize(self.position)
+        with PROFILER.section('process_queue'):
+            self.renderer.process_queue(self.simulation.position,
+                                        self.simulation.get_sight_vector(), dt)
+        sector = sectorize(self.simulation.position)
         if sector != self.sector:
-            self.model.change_sectors(self.sector, sector)
+            with PROFILER.section('change_sectors'):
+                self.renderer.change_sectors(self.sector, sector)
             if self.sector is None:
-                self.model.process_entire_queue()
+                self.renderer.process_entire_queue()
+            else:
+                # Write edits back whenever the player enters a new sector
+                # and let go of the columns left far behind.
+                self.simulation.model.save()
+                self.simulation.model.evict(sector)
             self.sector = sector
-        m = 8
-        dt = min(dt, 0.2)
-        for _ in xrange(m):
-            self._update(dt / m)
-
-    def _update(self, dt):
-        """ Private implementation of the `update()` method. This is where most
-        of the motion logic lives, along with gravity and collision detection.
+        with PROFILER.section('step'):
+            if self.recorder is None:
+                self.simulation.step(dt)
+            else:
+                # Fixed steps, so a replay does exactly the same work.
+                self.simulation.step(self.recorder.dt)
+                self.recorder.tick()
 
-        Parameters
-        ----------
-        dt : float
-            The change in time since the last call.
+    def act(self, action, *args):
+        """ Give the input `action` to the simulation, see `Replay.apply()`,
+        recording it if a recording is being made.
 
         """
-        # walking
-        speed = FLYING_SPEED if self.flying else WALKING_SPEED
-        d = dt * speed  # distance covered this tick.
-
-        bls = list(self.on_air.keys())
-        for pos in bls:
-            bx, by, bz = pos
-            
-            texture = self.on_air[pos]
-            vel = self.block_velocity[pos]
-            del self.on_air[pos]       
-            del self.block_velocity[pos]
-            # del self.model.world[pos]
-            self.model.remove_block(pos, True) 
-            
-            vel -= dt*GRAVITY
-            vel = max(vel, -TERMINAL_VELOCITY)
-            
-            (bx, by, bz), collides = self.collide((bx, by + vel*dt, bz), 1)
-            
-            if collides:
-                self.model.add_block(normalize((bx, by, bz)), texture, True)
-                continue
-            self.on_air[(bx, by, bz)] = texture
-            self.block_velocity[(bx, by, bz)] = vel
-            self.model.add_block((bx, by, bz), texture, True)
-
-
-        dx, dy, dz = self.get_motion_vector()
-        # New position in space, before accounting for gravity.
-        dx, dy, dz = dx * d, dy * d, dz * d
-        # gravity
-        if not self.flying:
-            # Update your vertical speed: if you are falling, speed up until you
-            # hit terminal velocity; if you are jumping, slow down until you
-            # start falling.
-            self.dy -= dt * GRAVITY
-            self.dy = max(self.dy, -TERMINAL_VELOCITY)
-            dy += self.dy * dt
-        # collisions
-        x, y, z = self.position
-        (x, y, z), collides = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
-        self.position = (x, y, z)
-
-    def collide(self, position, height):
-        """ Checks to see if the player at the given `position` and `height`
-        is colliding with any blocks in the world.
-
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position to check for collisions at.
-        height : int or float
-            The height of the player.
-
-        Returns
-        -------
-        position : tuple of len 3
-            The new position of the player taking into account collisions.
-
-        """
-        # How much overlap with a dimension of a surrounding block you need to
-        # have to count as a collision. If 0, touching terrain at all counts as
-        # a collision. If .49, you sink into the ground, as if walking through
-        # tall grass. If >= .5, you'll fall through the ground.
-        pad = 0.1 # 0.25
-        p = list(position)
-        np = normalize(position)
-        collides = False
-        for face in FACES:  # check all surrounding blocks
-            for i in xrange(3):  # check each dimension independently
-                if not face[i]:
-                    continue
-                # How much overlap you have with this dimension.
-                d = (p[i] - np[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in xrange(height):  # check each height
-                    op = list(np)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if tuple(op) not in self.model.world:
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    if face == (0, -1, 0) or face == (0, 1, 0):
-                        # You are colliding with the ground or ceiling, so stop
-                        # falling / rising.
-                        collides = True
-                        self.dy = 0
-                    break
-        return tuple(p), collides
+        apply(self.simulation, action, args)
+        if self.recorder is not None:
+            self.recorder.record(action, *args)
 
     def on_mouse_press(self, x, y, button, modifiers):
         """ Called when a mouse button is pressed. See pyglet docs for button
@@ -702,23 +562,12 @@ class Window(pyglet.window.Window):
 
         """
         if self.exclusive:
-            vector = self.get_sight_vector()
-            block, previous = self.model.hit_test(self.position, vector)
             if (button == mouse.RIGHT) or \
                     ((button == mouse.LEFT) and (modifiers & key.MOD_CTRL)):
                 # ON OSX, control + left click = right click.
-                if block is None:  # block is created on the air
-                    self.on_air[previous] = self.block
-                    self.model.add_block(previous, self.block)
-                    self.block_velocity[previous] = 0
-                
-                elif previous:
-                    self.model.add_block(previous, self.block)
-
-            elif button == pyglet.window.mouse.LEFT and block:
-                texture = self.model.world[block]
-                if texture != STONE:
-                    self.model.remove_block(block)
+                self.act('place_block')
+            elif button == pyglet.window.mouse.LEFT:
+                self.act('break_block')
         else:
             self.set_exclusive_mouse(True)
 
@@ -736,10 +585,7 @@ class Window(pyglet.window.Window):
         """
         if self.exclusive:
             m = 0.15
-            x, y = self.rotation
-            x, y = x + dx * m, y + dy * m
-            y = max(-90, min(90, y))
-            self.rotation = (x, y)
+            self.act('look', dx * m, dy * m)
 
     def on_key_press(self, symbol, modifiers):
         """ Called when the player presses a key. See pyglet docs for key
@@ -753,24 +599,28 @@ class Window(pyglet.window.Window):
             Number representing any modifying keys that were pressed.
 
         """
+        strafe = list(self.simulation.strafe)
         if symbol == key.W:
-            self.strafe[0] -= 1
+            strafe[0] -= 1
         elif symbol == key.S:
-            self.strafe[0] += 1
+            strafe[0] += 1
         elif symbol == key.A:
-            self.strafe[1] -= 1
+            strafe[1] -= 1
         elif symbol == key.D:
-            self.strafe[1] += 1
+            strafe[1] += 1
         elif symbol == key.SPACE:
-            if self.dy == 0:
-                self.dy = JUMP_SPEED
+            self.act('jump')
         elif symbol == key.ESCAPE:
             self.set_exclusive_mouse(False)
         elif symbol == key.TAB:
-            self.flying = not self.flying
+            self.act('flying', not self.simulation.flying)
+        elif symbol == key.F3:
+            self.hud = not self.hud
+            PROFILER.enable(self.hud or self.profile is not None)
         elif symbol in self.num_keys:
-            index = (symbol - self.num_keys[0]) % len(self.inventory)
-            self.block = self.inventory[index]
+            self.act('select', symbol - self.num_keys[0])
+        if strafe != self.simulation.strafe:
+            self.act('strafe', *strafe)
 
     def on_key_release(self, symbol, modifiers):
         """ Called when the player releases a key. See pyglet docs for key
@@ -784,14 +634,17 @@ class Window(pyglet.window.Window):
             Number representing any modifying keys that were pressed.
 
         """
+        strafe = list(self.simulation.strafe)
         if symbol == key.W:
-            self.strafe[0] += 1
+            strafe[0] += 1
         elif symbol == key.S:
-            self.strafe[0] -= 1
+            strafe[0] -= 1
         elif symbol == key.A:
-            self.strafe[1] += 1
+            strafe[1] += 1
         elif symbol == key.D:
-            self.strafe[1] -= 1
+            strafe[1] -= 1
+        if strafe != self.simulation.strafe:
+            self.act('strafe', *strafe)
 
     def on_resize(self, width, height):
         """ Called when the window is resized to a new `width` and `height`.
@@ -833,14 +686,19 @@ class Window(pyglet.window.Window):
         glViewport(0, 0, max(1, viewport[0]), max(1, viewport[1]))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(65.0, width / float(height), 0.1, 60.0)
+        gluPerspective(Frustum.FOVY, width / float(height), Frustum.NEAR,
+                       Frustum.FAR)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
-        x, y = self.rotation
+        x, y = self.simulation.rotation
         glRotatef(x, 0, 1, 0)
         glRotatef(-y, math.cos(math.radians(x)), 0, math.sin(math.radians(x)))
-        x, y, z = self.position
+        x, y, z = self.simulation.position
         glTranslatef(-x, -y, -z)
+        # The same transformation, kept to cull sectors outside the view.
+        self.frustum = Frustum.planes(Frustum.camera(
+            self.simulation.rotation, self.simulation.position,
+            width / float(height)))
 
     def on_draw(self):
         """ Called by pyglet to draw the canvas.
@@ -849,38 +707,58 @@ class Window(pyglet.window.Window):
         self.clear()
         self.set_3d()
         glColor3d(1, 1, 1)
-        self.model.batch.draw()
-        self.draw_focused_block()
+        with PROFILER.section('draw'):
+            drawn = self.renderer.draw(
+                self.frustum, sectorize(self.simulation.position))
+        PROFILER.count('sectors drawn', drawn)
+        self.draw_falling_blocks()
         self.set_2d()
         self.draw_label()
         self.draw_reticle()
-
-    def draw_focused_block(self):
-        """ Draw black edges around the block that is currently under the
-        crosshairs.
-
-        """
-        return
-        # vector = self.get_sight_vector()
-        # block = self.model.hit_test(self.position, vector)[0]
-        # if block:
-        #     x, y, z = block
-        #     vertex_data = cube_vertices(x, y, z, 0.51)
-        #     glColor3d(0, 0, 0)
-        #     glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-        #     pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertex_data))
-        #     glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
+        if PROFILER.enabled:
+            renderer = self.renderer
+            PROFILER.gauge('queue', len(renderer.queue))
+            PROFILER.gauge('pending meshes', len(renderer._pending))
+            PROFILER.gauge('vertex lists',
+                           sum(len(v) for v in renderer._shown.values()))
+            PROFILER.frame()
+
+    def draw_falling_blocks(self):
+        """ Draw all falling blocks from one vertex list that is refilled
+        every frame.
+
+        """
+        falling = self.simulation.falling
+        count = len(falling) * 24
+        if not count:
+            return
+        if self.falling_list is None:
+            self.falling_list = pyglet.graphics.vertex_list(
+                count, 'v3f/stream', 't2f/stream')
+        elif self.falling_list.get_size() != count:
+            self.falling_list.resize(count)
+        self.falling_list.vertices[:] = falling.vertex_data()
+        self.falling_list.tex_coords[:] = falling.texture_data(
+            self.simulation.model.world.types.uvs)
+        self.renderer.group.set_state()
+        self.falling_list.draw(GL_QUADS)
+        self.renderer.group.unset_state()
 
     def draw_label(self):
-        """ Draw the label in the top left of the screen.
+        """ Draw the label in the top left of the screen, with the frame
+        profile below it while the HUD is shown.
 
         """
-        return
-        x, y, z = self.position
+        if not self.hud:
+            return
+        x, y, z = self.simulation.position
         self.label.text = '%02d (%.2f, %.2f, %.2f) %d / %d' % (
             pyglet.clock.get_fps(), x, y, z,
-            len(self.model._shown), len(self.model.world))
+            len(self.renderer._shown), len(self.simulation.model.world))
         self.label.draw()
+        self.profile_label.y = self.height - 40
+        self.profile_label.text = '\n'.join(PROFILER.report())
+        self.profile_label.draw()
 
     def draw_reticle(self):
         """ Draw the crosshairs in the center of the screen.
@@ -929,13 +807,35 @@ def setup():
     setup_fog()
 
 
-def main():
-    window = Window(width=800, height=600, caption='CSE47101', resizable=True)
+def main(path=None, endless=False, seed=None, profile=None, record=None):
+    # Load the world from the region files in `path`, creating them if needed.
+    # An endless world is generated from `seed` as the player walks.
+    model = Model(world_size=None if endless else WORLD_SIZE, path=path,
+                  seed=seed)
+    window = Window(width=800, height=600, caption='CSE47101', resizable=True,
+                    model=model, profile=profile, record=bool(record))
     # Hide the mouse cursor and prevent the mouse from leaving the window.
     window.set_exclusive_mouse(True)
     setup()
     pyglet.app.run()
+    window.simulation.model.save()
+    if profile:
+        PROFILER.export(profile)
+    if record:
+        window.recorder.save(record)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Run the game.')
+    parser.add_argument('path', nargs='?',
+                        help='directory the world is saved to')
+    parser.add_argument('--endless', action='store_true',
+                        help='generate an endless world as the player walks')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the terrain, random by default')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write a Chrome trace of the frame profile here')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the input to replay with Replay.py')
+    args = parser.parse_args()
+    main(args.path, args.endless, args.seed, args.profile, args.record)
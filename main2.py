@@ -29,18 +29,38 @@ class Window(pyglet.window.Window):
     
     self.player = Player()
     self.world = World()
+    self.select(0)
 
     self.exclusive = False
 
+    # Sector the player is in, see `World.change_sectors()`.
+    self.sector = None
+
     self.num_keys = [key._1, key._2, key._3]
 
     pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
 
+  def select(self, index):
+    """ Make the inventory item at `index` the block the player places,
+    resolving its type id once here rather than on every click.
+
+    """
+    inventory = self.player.inventory
+    name = inventory[index % len(inventory)]
+    self.player.current_block = self.world.types.named(name)
+
   def set_exclusive_mouse(self, exclusive):
     super(Window, self).set_exclusive_mouse(exclusive)
     self.exclusive = exclusive
 
   def update(self, dt):
+    self.world.process_queue(1.0 / TICKS_PER_SEC)
+    sector = sectorize(self.player.position)
+    if sector != self.sector:
+      self.world.change_sectors(self.sector, sector)
+      if self.sector is None:
+        self.world.process_entire_queue()
+      self.sector = sector
     m = 8
     dt = min(dt, 0.2)
     for _ in range(m):
@@ -53,28 +73,19 @@ class Window(pyglet.window.Window):
     bls = list(self.world.on_air)
     for block in bls:
       bx, by, bz = block.getPosition()
-      
-      texture = self.world.block_to_texture[block]
       vel = block.velocity
       
-      self.world.on_air.remove(block) 
-      del self.world.block_to_texture[block]
-      self.world.remove_block(block)
-      
       vel -= dt*GRAVITY
       
       (bx, by, bz), collides = self.collision((bx, by + vel*dt, bz), 1)
       
       if collides:
-        self.world.block_to_texture[Block(normalize((bx, by, bz)))] = texture
-        self.world.add_block(Block(normalize((bx, by, bz))))
+        self.world.remove_falling(block)
+        self.world.add_block(normalize((bx, by, bz)), block.block_id)
         continue
       
-      new_block = Block((bx, by, bz))
-      self.world.block_to_texture[new_block] = texture
-      new_block.velocity = vel
-      self.world.on_air.add(new_block)
-      self.world.add_block(new_block)
+      block.velocity = vel
+      self.world.move_falling(block, (bx, by, bz))
 
     dx, dy, dz = self.player.get_motion_vector()
     dx, dy, dz = dx * d, dy * d, dz * d
@@ -89,8 +100,10 @@ class Window(pyglet.window.Window):
     pad = 0.1 # 0.25
     p = list(position)
     np = normalize(position)
+    blocks = self.world.world_blocks
+    key = pack(np)
     collides = False
-    for face in FACES:  
+    for face, step in zip(FACES, FACE_STEPS):
       for i in range(3):  
         if not face[i]:
           continue
@@ -98,10 +111,7 @@ class Window(pyglet.window.Window):
         if d < pad:
           continue
         for dy in range(height):
-          op = list(np)
-          op[1] -= dy
-          op[i] += face[i]
-          if Block(tuple(op)) not in self.world.world_blocks:
+          if key + step - dy * STEP_Y not in blocks:
             continue
           p[i] -= (d - pad) * face[i]
           if face == (0, -1, 0) or face == (0, 1, 0):
@@ -113,17 +123,15 @@ class Window(pyglet.window.Window):
   def on_mouse_press(self, x, y, button, modifiers):
     if self.exclusive:
       vector = self.player.get_look_vector()
-      block, previous = self.world.ray_trace(self.player.position, vector)
+      block, previous, face = self.world.ray_trace(self.player.position, vector)
       if (button == mouse.RIGHT) or ((button == mouse.LEFT) and (modifiers & key.MOD_CTRL)): 
-        new_block = Block(previous)
-        self.world.block_to_texture[new_block] = self.player.current_block_texture
+        block_id = self.player.current_block
         
         if block is None:  # block is created on the air
-          self.world.on_air.add(new_block)
-          self.world.add_block(new_block)
+          self.world.add_falling(previous, block_id)
         
         elif previous:
-          self.world.add_block(new_block)
+          self.world.add_block(previous, block_id)
           (a, b, c) = previous
           (x, y, z) = self.player.position
           if (a, 0, c) == normalize((x, 0, z)):
@@ -132,8 +140,7 @@ class Window(pyglet.window.Window):
               self.player.fall_velocity = JUMP_SPEED
 
       elif button == pyglet.window.mouse.LEFT and block:
-        if self.world.block_to_texture[block] != STONE:
-          del self.world.block_to_texture[block]
+        if self.world.types.breakable[self.world.block_id(block)]:
           self.world.remove_block(block)
     else:
         self.set_exclusive_mouse(True)
@@ -161,8 +168,7 @@ class Window(pyglet.window.Window):
     elif symbol == key.ESCAPE:
       self.set_exclusive_mouse(False)
     elif symbol in self.num_keys:
-      idx = (symbol - self.num_keys[0]) % len(self.player.inventory)
-      self.player.current_block_texture = self.player.inventory[idx]
+      self.select(symbol - self.num_keys[0])
 
   def on_key_release(self, symbol, m):
     if symbol in [key.W, key.S]: